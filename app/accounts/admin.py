@@ -1,10 +1,11 @@
 from django.contrib import admin
 
-from .models import AccountBook, Authority, Category, Consume, Proportion
+from .models import AccountBook, Authority, Category, Consume, ImportBatch, Proportion
 
 
 admin.site.register(AccountBook)
 admin.site.register(Authority)
 admin.site.register(Category)
 admin.site.register(Consume)
-admin.site.register(Proportion)
\ No newline at end of file
+admin.site.register(Proportion)
+admin.site.register(ImportBatch)
\ No newline at end of file
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class AccountsConfig(AppConfig):
-    name = 'accounts'
+    name = 'app.accounts'
+    label = 'accounts'
+
+    def ready(self):
+        from . import signals  # noqa: F401
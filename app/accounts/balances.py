@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import BookBalance, Proportion
+
+
+def balance_deltas(rows):
+    deltas = defaultdict(lambda: defaultdict(int))
+
+    for row in rows:
+        if row['is_repay']:
+            deltas[row['book'], row['creator']]['sent'] += row['fee']
+            deltas[row['book'], row['user']]['received'] += row['fee']
+        else:
+            deltas[row['book'], row['creator']]['paid'] += row['fee']
+            deltas[row['book'], row['user']]['owed'] += row['fee']
+
+    return deltas
+
+
+def apply(rows, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) ledger rows from the balances."""
+    for (book, user), columns in balance_deltas(rows).items():
+        columns = {
+            column: amount * sign
+            for column, amount in columns.items() if amount
+        }
+
+        if columns:
+            BookBalance.objects.increment(columns, book_id=book, user_id=user)
+
+
+def compute(books):
+    """Aggregate the balances of the given books from the raw proportions."""
+    proportions = Proportion.objects.filter(consume__book__in=books)
+    balances = defaultdict(lambda: defaultdict(int))
+
+    for row in proportions\
+            .values('consume__book', 'consume__creator', 'consume__is_repay')\
+            .annotate(total=Sum('fee')).order_by():
+        column = 'sent' if row['consume__is_repay'] else 'paid'
+        balances[row['consume__book'], row['consume__creator']][column] += row['total']
+
+    for row in proportions\
+            .values('consume__book', 'username', 'consume__is_repay')\
+            .annotate(total=Sum('fee')).order_by():
+        column = 'received' if row['consume__is_repay'] else 'owed'
+        balances[row['consume__book'], row['username']][column] += row['total']
+
+    return balances
+
+
+def rebuild(books):
+    """Replace the stored balances of the given books, returns the mismatches."""
+    expected = compute(books)
+    mismatches = verify(books, expected)
+
+    with transaction.atomic():
+        BookBalance.objects.filter(book__in=books).delete()
+        BookBalance.objects.bulk_create(
+            BookBalance(book_id=book, user_id=user, **columns)
+            for (book, user), columns in expected.items()
+        )
+
+    return mismatches
+
+
+def verify(books, expected=None):
+    """Compare the stored balances with freshly aggregated ones."""
+    if expected is None:
+        expected = compute(books)
+
+    stored = {
+        (balance.book_id, balance.user_id): balance
+        for balance in BookBalance.objects.filter(book__in=books)
+    }
+    mismatches = []
+
+    for key in set(expected) | set(stored):
+        columns = expected.get(key, {})
+        balance = stored.get(key)
+
+        for column in ('paid', 'owed', 'sent', 'received'):
+            actual = getattr(balance, column, 0)
+
+            if actual != columns.get(column, 0):
+                mismatches.append((key, column, actual, columns.get(column, 0)))
+
+    return sorted(mismatches)
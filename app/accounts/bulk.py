@@ -0,0 +1,48 @@
+from django.db import connections, router, transaction
+
+from .models import Consume, Proportion
+from .signals import bulk_insert, consumes_created
+
+
+def create_consumes(consumes, proportions, batch_size=None):
+    """
+    Insert consumes together with their proportions in one transaction.
+
+    ``proportions`` holds one list of unsaved ``Proportion`` per consume.
+    Rows are written with ``bulk_create`` and ``consumes_created`` is sent
+    afterwards so the derived tables stay in sync, since ``bulk_create``
+    does not send the model signals.
+    """
+    using = router.db_for_write(Consume)
+    can_return_rows = connections[using].features.can_return_rows_from_bulk_insert
+
+    with transaction.atomic(using=using), bulk_insert():
+        if can_return_rows:
+            Consume.objects.bulk_create(consumes, batch_size)
+        else:
+            # 無法取回自動編號的資料庫只能逐筆新增消費
+            for consume in consumes:
+                consume.save(using=using)
+
+        created = []
+        for consume, splits in zip(consumes, proportions):
+            for proportion in splits:
+                proportion.consume = consume
+                created.append(proportion)
+
+        Proportion.objects.bulk_create(created, batch_size)
+
+        if not can_return_rows and created:
+            # (username, consume) 是唯一的，一次查回自動編號
+            pks = {
+                (username, consume): pk for username, consume, pk in Proportion.objects
+                .filter(consume__in=consumes)
+                .values_list('username', 'consume', 'pk')
+            }
+            for proportion in created:
+                proportion.pk = pks[proportion.username_id, proportion.consume_id]
+
+        consumes_created.send(
+            sender=Consume, consumes=consumes, proportions=created)
+
+    return consumes
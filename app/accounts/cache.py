@@ -0,0 +1,115 @@
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+DEFAULTS = {
+    'BACKEND': 'lru',
+    'MAX_SIZE': 64 * 1024 * 1024,
+    'TIMEOUT': 300,
+}
+
+
+class LRUCache:
+    """
+    In-process cache bounded by the total size of its pickled values.
+
+    The least recently used entries are evicted first, so stale versions
+    of a book age out on their own once nobody asks for them.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+
+            if value is None:
+                return None
+
+            self.entries.move_to_end(key)
+
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        if len(value) > self.max_size:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            self.entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class DjangoCache:
+    """Adapter over one of the configured ``CACHES``."""
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    The response cache configured by ``ACCOUNTS_RESPONSE_CACHE``.
+
+    ``BACKEND`` is ``lru`` for the in-process cache bounded by ``MAX_SIZE``
+    bytes, or the alias of one of the ``CACHES`` to share entries between
+    processes for ``TIMEOUT`` seconds.
+    """
+    global _backend
+
+    with _lock:
+        if _backend is None:
+            config = {**DEFAULTS, **getattr(settings, 'ACCOUNTS_RESPONSE_CACHE', {})}
+
+            if config['BACKEND'] == 'lru':
+                _backend = LRUCache(config['MAX_SIZE'])
+            else:
+                _backend = DjangoCache(config['BACKEND'], config['TIMEOUT'])
+
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+
+    if setting == 'ACCOUNTS_RESPONSE_CACHE':
+        _backend = None
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import F
+
+from . import events
+from .models import AccountBook, Change
+
+
+def record(book, model, object_ids, action):
+    """
+    Append changes to the log of a book and return its new sequence.
+
+    The sequence is bumped with an ``UPDATE`` on the book row, which holds
+    the row lock until the surrounding transaction commits, so sequences are
+    handed out without gaps and in commit order.
+    """
+    object_ids = list(object_ids)
+
+    if not object_ids:
+        return None
+
+    with transaction.atomic(savepoint=False):
+        books = AccountBook.objects.filter(pk=book)
+
+        if not books.update(sequence=F('sequence') + len(object_ids)):
+            return None
+
+        sequence = books.values_list('sequence', flat=True).get()
+        first = sequence - len(object_ids) + 1
+        Change.objects.bulk_create([
+            Change(
+                book_id=book,
+                sequence=first + index,
+                model=model._meta.model_name,
+                object_id=object_id,
+                action=action,
+            ) for index, object_id in enumerate(object_ids)
+        ])
+
+    events.publish(
+        book,
+        sequence,
+        model._meta.model_name,
+        object_ids,
+        Change.ACTION_CHOICES[action][1],
+    )
+
+    return sequence
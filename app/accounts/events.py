@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+MAX_IDS = 100
+
+
+class Broker:
+    """
+    Fan change events of a book out to its subscribers.
+
+    ``publish`` is called from request threads after a commit and
+    ``subscribe`` from the event loop serving the stream. Brokers that fan
+    out across workers relay published messages to the other processes and
+    hand them to ``deliver`` there.
+    """
+
+    def publish(self, book, message):
+        raise NotImplementedError
+
+    def subscribe(self, book):
+        raise NotImplementedError
+
+    def unsubscribe(self, book, subscription):
+        raise NotImplementedError
+
+
+class Subscription:
+    def __init__(self, max_size=100):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(max_size)
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 跟不上的連線只收到 overflow，由客戶端改用 changes 補齊
+            self.queue.get_nowait()
+            self.queue.put_nowait({'event': 'overflow'})
+
+
+class LocalBroker(Broker):
+    """Deliver messages to the subscribers of this process only."""
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, book, message):
+        self.deliver(book, message)
+
+    def deliver(self, book, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(book, ()))
+
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, message)
+
+    def subscribe(self, book):
+        subscription = Subscription()
+
+        with self.lock:
+            self.subscriptions[book].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, book, subscription):
+        with self.lock:
+            self.subscriptions[book].discard(subscription)
+
+            if not self.subscriptions[book]:
+                del self.subscriptions[book]
+
+
+_broker = None
+_lock = threading.Lock()
+
+
+def get_broker():
+    """The broker configured by ``ACCOUNTS_EVENT_BROKER``."""
+    global _broker
+
+    with _lock:
+        if _broker is None:
+            _broker = import_string(getattr(
+                settings, 'ACCOUNTS_EVENT_BROKER', 'app.accounts.events.LocalBroker'))()
+
+    return _broker
+
+
+def publish(book, sequence, model, object_ids, action):
+    """
+    Send a compact change event to the members of a book once committed.
+
+    Large batches are sent without their ids, clients fetch them from the
+    change log starting at their last sequence.
+    """
+    message = {
+        'event': 'change',
+        'sequence': sequence,
+        'model': model,
+        'ids': object_ids if len(object_ids) <= MAX_IDS else None,
+        'action': action,
+    }
+
+    transaction.on_commit(lambda: get_broker().publish(book, message))
+
+
+def encode(message):
+    """Format a message as a Server-Sent Event."""
+    lines = []
+
+    if 'sequence' in message:
+        lines.append(f'id: {message["sequence"]}')
+
+    lines.append(f'event: {message["event"]}')
+    lines.append(f'data: {json.dumps(message, separators=(",", ":"))}')
+
+    return ('\n'.join(lines) + '\n\n').encode()
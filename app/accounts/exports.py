@@ -0,0 +1,103 @@
+import csv
+import itertools
+import json
+from collections import defaultdict
+
+from .models import Consume, Proportion
+
+
+FIELDS = (
+    'id',
+    'name',
+    'consume_at',
+    'creator',
+    'category',
+    'is_repay',
+    'amount',
+    'note',
+    'description',
+    'proportions',
+)
+
+
+class Echo:
+    """File-like object that hands each written line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def consume_rows(book, chunk_size=2000):
+    """
+    Yield every consume of the book with its category name and splits.
+
+    Consumes are read through a chunked ``iterator()`` and the proportions
+    of each chunk are fetched in one extra query, so memory stays bounded by
+    ``chunk_size`` however large the book is.
+    """
+    consumes = Consume.objects\
+        .filter(book=book)\
+        .order_by('pk')\
+        .values_list(
+            'pk',
+            'name',
+            'consume_at',
+            'creator__email',
+            'category__name',
+            'is_repay',
+            'note',
+            'description',
+        )\
+        .iterator(chunk_size=chunk_size)
+
+    while True:
+        chunk = list(itertools.islice(consumes, chunk_size))
+
+        if not chunk:
+            return
+
+        proportions = defaultdict(list)
+        for consume, email, fee in Proportion.objects\
+                .filter(consume__in=[row[0] for row in chunk])\
+                .order_by('pk')\
+                .values_list('consume', 'username__email', 'fee'):
+            proportions[consume].append({'user': email, 'fee': fee})
+
+        for pk, name, consume_at, creator, category, is_repay, note, description in chunk:
+            splits = proportions[pk]
+
+            yield {
+                'id': pk,
+                'name': name,
+                'consume_at': consume_at.isoformat(),
+                'creator': creator,
+                'category': category,
+                'is_repay': is_repay,
+                'amount': sum(split['fee'] for split in splits),
+                'note': note,
+                'description': description,
+                'proportions': splits,
+            }
+
+
+def export_csv(book):
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(FIELDS)
+    for row in consume_rows(book):
+        row['is_repay'] = int(row['is_repay'])
+        row['proportions'] = ';'.join(
+            f'{split["user"]}:{split["fee"]}' for split in row['proportions'])
+
+        yield writer.writerow([row[field] for field in FIELDS])
+
+
+def export_jsonl(book):
+    for row in consume_rows(book):
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (export_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,268 @@
+import csv
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+from app.users.models import User
+
+from . import changes
+from .bulk import create_consumes
+from .models import Authority, Category, Change, Consume, ImportBatch, Proportion
+
+
+MAX_ERRORS = 1000
+# 匯入中的請求超過這麼久沒有提交任何一段，視為已中斷，可以由其他請求接手
+RUN_TIMEOUT = datetime.timedelta(minutes=5)
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n'}
+
+
+class ImportConflict(Exception):
+    pass
+
+
+class MalformedFile(Exception):
+    pass
+
+
+def file_key(upload):
+    """Idempotency key of an uploaded file, the SHA-256 of its content."""
+    digest = hashlib.sha256()
+
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+
+    return digest.hexdigest()
+
+
+def text_rows(binary):
+    """
+    Parse a binary CSV stream lazily, yielding ``(line, row)`` pairs.
+
+    A file that is not UTF-8 or not CSV raises ``MalformedFile`` where the
+    reading stops, the chunks committed before it are kept.
+    """
+    reader = csv.DictReader(
+        io.TextIOWrapper(binary, encoding='utf-8-sig', newline=''))
+
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise MalformedFile(f'Cannot read the file after line {reader.line_num}: {e}')
+
+
+class RowParser:
+    """Validate CSV rows against the members and categories of a book."""
+
+    def __init__(self, book):
+        self.book = book
+        self.members = dict(Authority.objects
+                            .filter(book=book)
+                            .exclude(authority=Authority.LEAVE)
+                            .values_list('user__email', 'user'))
+        self.categories = dict(Category.objects
+                               .filter(book=book)
+                               .values_list('name', 'pk'))
+
+    def member(self, email, errors, field):
+        user = self.members.get(User.objects.normalize_email(email.strip()))
+
+        if user is None:
+            errors[field] = [f'{email} is not a member of the book.']
+
+        return user
+
+    def parse(self, row):
+        errors = {}
+        name = (row.get('name') or '').strip()
+        category = (row.get('category') or '').strip() or None
+        is_repay = (row.get('is_repay') or '').strip().lower()
+        amount = (row.get('amount') or '').strip()
+
+        if not name or len(name) > 255:
+            errors['name'] = ['Ensure this field has 1 to 255 characters.']
+        if category and len(category) > 255:
+            errors['category'] = ['Ensure this field has no more than 255 characters.']
+        if is_repay not in TRUE_VALUES | FALSE_VALUES:
+            errors['is_repay'] = ['Must be a valid boolean.']
+
+        try:
+            consume_at = datetime.date.fromisoformat((row.get('consume_at') or '').strip())
+        except ValueError:
+            errors['consume_at'] = ['Date has wrong format. Use YYYY-MM-DD.']
+
+        try:
+            amount = int(amount) if amount else None
+            assert amount is None or amount >= 0
+        except (ValueError, AssertionError):
+            errors['amount'] = ['A valid positive integer is required.']
+
+        creator = self.member(row.get('creator') or '', errors, 'creator')
+        splits = self.splits(row.get('proportions') or '', errors)
+
+        if not errors and not splits:
+            if amount is None:
+                errors['amount'] = ['Required when there are no proportions.']
+            else:
+                splits = [(creator, amount)]
+        elif not errors and amount is not None and amount != sum(fee for _, fee in splits):
+            errors['amount'] = ['Does not match the sum of the proportions.']
+
+        if errors:
+            return None, errors
+
+        return {
+            'consume': Consume(
+                name=name,
+                note=row.get('note') or '',
+                description=row.get('description') or '',
+                creator_id=creator,
+                book=self.book,
+                is_repay=is_repay in TRUE_VALUES,
+                consume_at=consume_at,
+            ),
+            'category': category,
+            'proportions': [
+                Proportion(username_id=user, fee=fee) for user, fee in splits
+            ],
+        }, None
+
+    def splits(self, value, errors):
+        splits = []
+
+        for split in filter(None, (split.strip() for split in value.split(';'))):
+            email, _, fee = split.rpartition(':')
+            user = self.member(email, errors, 'proportions')
+
+            try:
+                fee = int(fee)
+                assert fee >= 0
+            except (ValueError, AssertionError):
+                errors['proportions'] = [f'{split} has no valid fee.']
+                continue
+
+            splits.append((user, fee))
+
+        if len({user for user, _ in splits}) != len(splits) and 'proportions' not in errors:
+            errors['proportions'] = ['Duplicated member.']
+
+        return splits
+
+    def resolve_categories(self, names):
+        """Create the missing categories of a chunk in one statement."""
+        missing = set(names) - set(self.categories) - {None}
+
+        if missing:
+            Category.objects.bulk_create(
+                [Category(name=name, book=self.book) for name in missing],
+                ignore_conflicts=True,
+            )
+            created = dict(Category.objects
+                           .filter(book=self.book, name__in=missing)
+                           .values_list('name', 'pk'))
+            self.categories.update(created)
+            changes.record(self.book.pk, Category, created.values(), Change.CREATED)
+
+
+def claim(book, key):
+    """
+    Lock the ``ImportBatch`` of ``key`` and mark it as run by the caller.
+
+    The progress is read under the lock, and a batch run by another request
+    that committed a chunk within ``RUN_TIMEOUT`` is rejected.
+    """
+    with transaction.atomic():
+        batch, _ = ImportBatch.objects\
+            .select_for_update()\
+            .get_or_create(book=book, key=key)
+
+        if batch.finished:
+            return batch
+        if batch.runner is not None and batch.update_at > timezone.now() - RUN_TIMEOUT:
+            raise ImportConflict('The same file is being imported.')
+
+        batch.runner = uuid.uuid4()
+        batch.save()
+
+    return batch
+
+
+def import_consumes(book, rows, key, batch_size=1000):
+    """
+    Import parsed CSV rows into the book in chunks of ``batch_size``.
+
+    Each chunk is committed together with the progress of its
+    ``ImportBatch``, so importing the same key again resumes after the last
+    committed chunk and never duplicates rows. Only one request imports a
+    key at a time.
+    """
+    batch = claim(book, key)
+    errors = json.loads(batch.errors or '[]')
+    skipped = batch.rows
+
+    if not batch.finished:
+        try:
+            parser = RowParser(book)
+            rows = itertools.islice(rows, batch.rows, None)
+
+            while True:
+                chunk = list(itertools.islice(rows, batch_size))
+
+                if not chunk:
+                    break
+
+                parsed = []
+                for line, row in chunk:
+                    item, error = parser.parse(row)
+
+                    if error:
+                        if len(errors) < MAX_ERRORS:
+                            errors.append({'line': line, 'errors': error})
+                    else:
+                        parsed.append(item)
+
+                with transaction.atomic():
+                    locked = ImportBatch.objects.select_for_update().get(pk=batch.pk)
+
+                    # 停太久被其他請求接手了
+                    if locked.runner != batch.runner:
+                        raise ImportConflict('The same file is being imported.')
+
+                    parser.resolve_categories(item['category'] for item in parsed)
+                    for item in parsed:
+                        item['consume'].category_id = parser.categories.get(item['category'])
+
+                    create_consumes(
+                        [item['consume'] for item in parsed],
+                        [item['proportions'] for item in parsed],
+                        batch_size,
+                    )
+
+                    batch.rows += len(chunk)
+                    batch.created += len(parsed)
+                    batch.errors = json.dumps(errors)
+                    batch.save()
+
+            batch.finished = True
+        finally:
+            # 中斷時也要放掉，重新匯入才能馬上接續
+            ImportBatch.objects\
+                .filter(pk=batch.pk, runner=batch.runner)\
+                .update(runner=None, finished=batch.finished)
+
+    return {
+        'key': batch.key,
+        'rows': batch.rows,
+        'created': batch.created,
+        'skipped': skipped,
+        'errors': errors,
+        'finished': batch.finished,
+    }
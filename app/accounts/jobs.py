@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.utils import timezone
+
+from app.jobs.queue import enqueue
+
+from . import uploads
+from .models import UploadSession
+
+
+def expire_upload_session(session):
+    """Delete an upload session once it went unused for the expiry."""
+    session = UploadSession.objects.filter(pk=session).first()
+
+    # 排隊期間可能已被刪除
+    if session is None:
+        return
+
+    idle = (timezone.now() - session.update_at).total_seconds()
+
+    if idle < settings.UPLOAD_SESSION_EXPIRY:
+        # 期間還有收到資料，等到最後一次更新後滿期再檢查
+        enqueue(expire_upload_session, str(session.pk),
+                delay=settings.UPLOAD_SESSION_EXPIRY - idle)
+        return
+
+    if UploadSession.objects.filter(pk=session.pk, update_at=session.update_at).delete()[0]:
+        uploads.discard(session)
@@ -0,0 +1,51 @@
+from . import balances, rollups
+
+
+def month_of(date):
+    return date.replace(day=1)
+
+
+def consume_row(consume, **extra):
+    return {
+        'book': consume.book_id,
+        'creator': consume.creator_id,
+        'is_repay': consume.is_repay,
+        'category': consume.category_id,
+        'month': month_of(consume.consume_at),
+        **extra,
+    }
+
+
+def proportion_rows(proportions):
+    """
+    Flatten ``Proportion`` querysets into the rows the ledger works with.
+
+    Each row carries the consume attributes a proportion contributes under,
+    so callers can apply it to the derived tables without touching the
+    consume again.
+    """
+    return [
+        {
+            'book': row['consume__book'],
+            'creator': row['consume__creator'],
+            'is_repay': row['consume__is_repay'],
+            'category': row['consume__category'],
+            'month': month_of(row['consume__consume_at']),
+            'user': row['username'],
+            'fee': row['fee'],
+        } for row in proportions.values(
+            'consume__book',
+            'consume__creator',
+            'consume__is_repay',
+            'consume__category',
+            'consume__consume_at',
+            'username',
+            'fee',
+        )
+    ]
+
+
+def apply(rows, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) rows from every derived table."""
+    balances.apply(rows, sign)
+    rollups.apply(rows, sign)
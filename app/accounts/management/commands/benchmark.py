@@ -0,0 +1,86 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from app.accounts.models import Authority
+from app.users.models import User
+from core import benchmark
+from core.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Time every GET endpoint of the API and write the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='E-mail of the user to request as, defaults to the member of most books.')
+        parser.add_argument(
+            '--book', type=int,
+            help='Account book to request, defaults to the largest book of the user.')
+        parser.add_argument(
+            '--repeat', type=int, default=50, help='Timed requests per endpoint.')
+        parser.add_argument(
+            '--endpoint', action='append', dest='endpoints',
+            help='Only run the named route, may be given several times.')
+        parser.add_argument(
+            '--warm', action='store_true',
+            help='Keep the response cache between requests.')
+        parser.add_argument('--output', help='Write the JSON results to this file.')
+        parser.add_argument(
+            '--compare', help='Print the changes against an earlier result file.')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        book = options['book'] or Authority.objects\
+            .filter(user=user)\
+            .exclude(authority=Authority.LEAVE)\
+            .annotate(members=Count('book__book'))\
+            .order_by('-members', 'book')\
+            .values_list('book', flat=True)\
+            .first()
+
+        if book is None:
+            raise CommandError(f'{user} is not a member of any book, run seed_benchmark first.')
+
+        results = benchmark.run(
+            router, user, book, options['repeat'], options['warm'], options['endpoints'])
+        output = json.dumps(results, indent=2, sort_keys=True, ensure_ascii=False)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as compare_file:
+                self.compare(json.load(compare_file)['endpoints'], results['endpoints'])
+
+    def get_user(self, email):
+        if email is None:
+            user = User.objects\
+                .annotate(memberships=Count('share'))\
+                .order_by('-memberships', 'pk')\
+                .first()
+        else:
+            user = User.objects.filter(email=email).first()
+
+        if user is None:
+            raise CommandError('No user to request as, run seed_benchmark first.')
+
+        return user
+
+    def compare(self, before, after):
+        for name in sorted(set(before) | set(after)):
+            if name not in before or name not in after:
+                self.stderr.write(f'{name}: only in {"new" if name in after else "old"} results')
+                continue
+
+            old, new = before[name], after[name]
+            change = (new['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+
+            self.stderr.write(
+                f'{name}: p50 {old["p50_ms"]} -> {new["p50_ms"]} ms ({change:+.1f}%), '
+                f'queries {old["queries"]} -> {new["queries"]}')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app.accounts import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned upload sessions and partial files without a session.'
+
+    def handle(self, *args, **options):
+        count = uploads.expire()
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired upload sessions.'))
@@ -0,0 +1,47 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from app.accounts.imports import (
+    ImportConflict,
+    MalformedFile,
+    file_key,
+    import_consumes,
+    text_rows,
+)
+from app.accounts.models import AccountBook
+
+
+class Command(BaseCommand):
+    help = 'Import a CSV of consumes into an account book.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book', type=int, help='Account book id.')
+        parser.add_argument('path', help='CSV file in the export format.')
+        parser.add_argument(
+            '--key',
+            help='Idempotency key, defaults to the SHA-256 of the file.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows validated and written per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            book = AccountBook.objects.get(pk=options['book'])
+        except AccountBook.DoesNotExist:
+            raise CommandError(f'Account book {options["book"]} does not exist.')
+
+        with open(options['path'], 'rb') as csv_file:
+            key = options['key'] or file_key(File(csv_file))
+
+            try:
+                report = import_consumes(
+                    book, text_rows(csv_file), key, options['batch_size'])
+            except (ImportConflict, MalformedFile) as e:
+                raise CommandError(e)
+
+        for error in report['errors']:
+            self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report["created"]} of {report["rows"]} rows '
+            f'({report["skipped"]} already imported, {len(report["errors"])} errors).'))
@@ -0,0 +1,13 @@
+from app.accounts import balances
+from app.accounts.management.rebuild import RebuildCommand
+
+
+class Command(RebuildCommand):
+    help = 'Rebuild the per-book balances from the raw consumes and proportions.'
+    module = balances
+    noun = 'balances'
+
+    def describe(self, mismatch):
+        (book, user), column, actual, expected = mismatch
+
+        return f'book {book} user {user}: {column} is {actual}, expected {expected}'
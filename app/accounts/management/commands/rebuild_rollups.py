@@ -0,0 +1,13 @@
+from app.accounts import rollups
+from app.accounts.management.rebuild import RebuildCommand
+
+
+class Command(RebuildCommand):
+    help = 'Rebuild the monthly spending rollups from the raw consumes and proportions.'
+    module = rollups
+    noun = 'rollups'
+
+    def describe(self, mismatch):
+        kind, (book, month, key), actual, expected = mismatch
+
+        return f'book {book} {month:%Y-%m} {kind} {key}: amount is {actual}, expected {expected}'
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from app.accounts import search
+from app.accounts.models import AccountBook
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the consumes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'books', nargs='*', type=int,
+            help='Account book ids, defaults to every book.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of consumes indexed per statement.')
+
+    def handle(self, *args, **options):
+        books = AccountBook.objects.order_by('pk').values_list('pk', flat=True)
+
+        if options['books']:
+            books = books.filter(pk__in=options['books'])
+
+        books = list(books)
+        search.rebuild(books, options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the search index of {len(books)} books.'))
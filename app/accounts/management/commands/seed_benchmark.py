@@ -0,0 +1,154 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.accounts import changes
+from app.accounts.bulk import create_consumes
+from app.accounts.models import (
+    AccountBook,
+    Authority,
+    Category,
+    Change,
+    Consume,
+    Proportion,
+)
+from app.users.models import User
+
+
+CATEGORIES = [
+    '餐飲', '交通', '住宿', '日用品', '娛樂', '門票', '水電', '房租',
+    '旅遊', '醫療', '教育', '禮物', '保險', '通訊', '寵物', '其他',
+]
+NAMES = [
+    '早餐店', '午餐便當', '晚餐火鍋', '手搖飲', '便利商店', '超市採買',
+    '高鐵車票', '計程車', '加油', '停車費', '電影票', '演唱會',
+    '民宿', '飯店', '電費', '水費', '網路費', '房租', 'coffee',
+    'taxi', 'groceries', 'dinner', 'hotel', 'train tickets',
+]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a large synthetic data set for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=2000, help='Number of users.')
+        parser.add_argument(
+            '--books', type=int, default=500, help='Number of account books.')
+        parser.add_argument(
+            '--consumes', type=int, default=1000000, help='Number of consumes.')
+        parser.add_argument(
+            '--max-members', type=int, default=200,
+            help='Largest number of members of a book.')
+        parser.add_argument(
+            '--years', type=int, default=3,
+            help='Consumes are spread over this many years up to today.')
+        parser.add_argument(
+            '--seed', type=int, default=0, help='Seed of the random generator.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of consumes written per transaction.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        users = self.create_users(options['users'])
+        books = self.create_books(rng, users, options['books'], options['max_members'])
+        self.create_consumes(
+            rng, books, options['consumes'], options['years'], options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {len(books)} books and '
+            f'{options["consumes"]} consumes.'))
+
+    def create_users(self, count):
+        # 雜湊密碼很慢，所有使用者共用同一組，密碼為 benchmark
+        password = make_password('benchmark')
+        offset = User.objects.count()
+        emails = [f'benchmark{offset + i}@example.com' for i in range(count)]
+
+        User.objects.bulk_create([
+            User(email=email, first_name='Benchmark', last_name=str(offset + i), password=password)
+            for i, email in enumerate(emails)
+        ])
+
+        return list(User.objects
+                    .filter(email__in=emails)
+                    .order_by('pk')
+                    .values_list('pk', flat=True))
+
+    def create_books(self, rng, users, count, max_members):
+        """``(book, members, categories)`` of the created books."""
+        books = []
+
+        with transaction.atomic():
+            for i in range(count):
+                # 多數帳本只有幾個人，少數是上百人的大團體
+                size = min(int(rng.expovariate(1 / 8)) + 1, max_members, len(users))
+                members = rng.sample(users, size)
+                book = AccountBook.objects.create(title=f'Benchmark {i}')
+
+                Authority.objects.bulk_create([
+                    Authority(
+                        user_id=user,
+                        book=book,
+                        authority=Authority.CREATOR if index == 0 else
+                        rng.choice([Authority.WRITER, Authority.WRITER, Authority.READER]),
+                    )
+                    for index, user in enumerate(members)
+                ])
+                Category.objects.bulk_create([
+                    Category(name=name, book=book)
+                    for name in rng.sample(CATEGORIES, rng.randint(3, len(CATEGORIES)))
+                ])
+
+                # SQLite 的 bulk_create 取不回自動編號，再查一次
+                authorities = list(Authority.objects
+                                   .filter(book=book)
+                                   .values_list('pk', flat=True))
+                categories = list(Category.objects
+                                  .filter(book=book)
+                                  .order_by('pk')
+                                  .values_list('pk', flat=True))
+                # bulk_create 不送訊號，和匯入一樣補記變更紀錄；
+                # 新使用者還沒有憑證，不必撤銷
+                changes.record(book.pk, Authority, authorities, Change.CREATED)
+                changes.record(book.pk, Category, categories, Change.CREATED)
+
+                books.append((book.pk, members, categories))
+
+        return books
+
+    def create_consumes(self, rng, books, count, years, batch_size):
+        today = datetime.date.today()
+        days = max(years, 1) * 365
+        # 人多的帳本記帳也比較頻繁
+        weights = [len(members) for _, members, _ in books]
+
+        for start in range(0, count, batch_size):
+            consumes, proportions = [], []
+
+            for book, members, categories in rng.choices(
+                    books, weights, k=min(batch_size, count - start)):
+                creator = rng.choice(members)
+                shares = rng.sample(members, rng.randint(1, min(len(members), 4)))
+
+                consumes.append(Consume(
+                    name=rng.choice(NAMES),
+                    note='',
+                    creator_id=creator,
+                    category_id=rng.choice(categories) if rng.random() < 0.9 else None,
+                    book_id=book,
+                    is_repay=rng.random() < 0.05,
+                    consume_at=today - datetime.timedelta(rng.randrange(days)),
+                ))
+                proportions.append([
+                    Proportion(username_id=user, fee=rng.randint(10, 5000))
+                    for user in shares
+                ])
+
+            create_consumes(consumes, proportions)
+            self.stdout.write(f'{start + len(consumes)} / {count} consumes')
@@ -0,0 +1,55 @@
+from abc import ABCMeta, abstractmethod
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.accounts.models import AccountBook
+
+
+class RebuildCommand(BaseCommand, metaclass=ABCMeta):
+    """
+    Rebuild or ``--verify`` derived data of account books in batches.
+
+    Subclasses set ``module``, which has ``rebuild(books)`` and
+    ``verify(books)`` returning the mismatches, and ``describe`` a mismatch.
+    """
+    module = None
+    noun = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'books', nargs='*', type=int,
+            help='Account book ids, defaults to every book.')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report the mismatches without writing anything.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of books rebuilt per transaction.')
+
+    @abstractmethod
+    def describe(self, mismatch):
+        """One line of the report for a mismatch returned by ``module``."""
+
+    def handle(self, *args, **options):
+        books = AccountBook.objects.order_by('pk').values_list('pk', flat=True)
+
+        if options['books']:
+            books = books.filter(pk__in=options['books'])
+
+        books = list(books)
+        batch_size = options['batch_size']
+        run = self.module.verify if options['verify'] else self.module.rebuild
+        mismatches = []
+
+        for start in range(0, len(books), batch_size):
+            mismatches += run(books[start:start + batch_size])
+
+        for mismatch in mismatches:
+            self.stderr.write(self.describe(mismatch))
+
+        if options['verify'] and mismatches:
+            raise CommandError(f'{len(mismatches)} mismatched {self.noun}.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Verified" if options["verify"] else "Rebuilt"} {len(books)} books, '
+            f'{len(mismatches)} mismatched {self.noun}.'))
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid', models.BigIntegerField(default=0, verbose_name='代墊')),
+                ('owed', models.BigIntegerField(default=0, verbose_name='應付')),
+                ('sent', models.BigIntegerField(default=0, verbose_name='已還款')),
+                ('received', models.BigIntegerField(default=0, verbose_name='已收款')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='accounts.AccountBook', verbose_name='帳本')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to=settings.AUTH_USER_MODEL, verbose_name='使用者')),
+            ],
+            options={
+                'unique_together': {('book', 'user')},
+            },
+        ),
+    ]
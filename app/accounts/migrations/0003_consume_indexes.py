@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_bookbalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consume',
+            index=models.Index(fields=['book', 'consume_at', 'id'], name='accounts_co_book_id_d2afc7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consume',
+            index=models.Index(fields=['book', 'is_repay'], name='accounts_co_book_id_60f04c_idx'),
+        ),
+    ]
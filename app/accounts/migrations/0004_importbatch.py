@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_consume_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, verbose_name='冪等鍵')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='已處理筆數')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='已新增筆數')),
+                ('errors', models.TextField(blank=True, verbose_name='錯誤')),
+                ('finished', models.BooleanField(default=False)),
+                ('create_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('update_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imports', to='accounts.AccountBook', verbose_name='帳本')),
+            ],
+            options={
+                'unique_together': {('book', 'key')},
+            },
+        ),
+    ]
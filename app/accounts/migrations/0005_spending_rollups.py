@@ -0,0 +1,42 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0004_importbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyPayerSpending',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='月份')),
+                ('amount', models.BigIntegerField(default=0, verbose_name='金額')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payer_spending', to='accounts.AccountBook', verbose_name='帳本')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_paid', to=settings.AUTH_USER_MODEL, verbose_name='付款人')),
+            ],
+            options={
+                'unique_together': {('book', 'month', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyCategorySpending',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='月份')),
+                ('amount', models.BigIntegerField(default=0, verbose_name='金額')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_spending', to='accounts.AccountBook', verbose_name='帳本')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounts.Category', verbose_name='分類')),
+            ],
+            options={
+                'unique_together': {('book', 'month', 'category')},
+            },
+        ),
+    ]
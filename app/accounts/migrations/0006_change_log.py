@@ -0,0 +1,34 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_spending_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountbook',
+            name='sequence',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='變更序號'),
+        ),
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.BigIntegerField(verbose_name='變更序號')),
+                ('model', models.CharField(max_length=32, verbose_name='資料表')),
+                ('object_id', models.PositiveIntegerField(verbose_name='資料編號')),
+                ('action', models.PositiveSmallIntegerField(choices=[(0, 'created'), (1, 'updated'), (2, 'deleted')])),
+                ('create_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='accounts.AccountBook', verbose_name='帳本')),
+            ],
+            options={
+                'unique_together': {('book', 'sequence')},
+            },
+        ),
+    ]
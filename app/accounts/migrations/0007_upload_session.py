@@ -0,0 +1,30 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0006_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='檔名')),
+                ('size', models.PositiveIntegerField(verbose_name='檔案大小')),
+                ('received', models.PositiveIntegerField(default=0, verbose_name='已接收大小')),
+                ('create_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('update_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+                ('consume', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.Consume', verbose_name='消費')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to=settings.AUTH_USER_MODEL, verbose_name='使用者')),
+            ],
+        ),
+    ]
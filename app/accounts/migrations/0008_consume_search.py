@@ -0,0 +1,80 @@
+import re
+
+from django.db import migrations
+
+
+# 與當時的 app.accounts.search 相同，複製一份讓之後修改那邊時不影響這個 migration
+TABLE = 'accounts_consume_fts'
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN = re.compile(rf'[{CJK}]+|(?:(?![{CJK}])[^\W_])+')
+IS_CJK = re.compile(rf'[{CJK}]')
+
+CREATE = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5(document, book UNINDEXED, tokenize='unicode61')",
+    ],
+    'postgresql': [
+        f'CREATE TABLE {TABLE} (rowid integer PRIMARY KEY, book integer NOT NULL, document tsvector NOT NULL)',
+        f'CREATE INDEX {TABLE}_document ON {TABLE} USING gin (document)',
+        f'CREATE INDEX {TABLE}_book ON {TABLE} (book)',
+    ],
+}
+INSERT = {
+    'sqlite': f'INSERT INTO {TABLE} (rowid, book, document) VALUES (%s, %s, %s)',
+    'postgresql':
+        f"INSERT INTO {TABLE} (rowid, book, document) VALUES (%s, %s, to_tsvector('simple', %s))",
+}
+
+
+def tokens(text):
+    for match in TOKEN.finditer(text.lower()):
+        run = match.group()
+
+        if IS_CJK.match(run):
+            yield from run
+            yield from (run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            yield run
+
+
+def document(*texts):
+    return ' '.join(tokens(' '.join(filter(None, texts))))
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor not in CREATE:
+        return
+
+    for statement in CREATE[vendor]:
+        schema_editor.execute(statement)
+
+    Consume = apps.get_model('accounts', 'Consume')
+    rows = Consume.objects\
+        .using(schema_editor.connection.alias)\
+        .order_by('pk')\
+        .values_list('pk', 'book', 'name', 'note', 'description', 'category__name')\
+        .iterator()
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(INSERT[vendor], (
+            (pk, book, document(name, note, description, category))
+            for pk, book, name, note, description, category in rows
+        ))
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute(f'DROP TABLE {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_upload_session'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_consume_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='writer',
+            field=models.UUIDField(blank=True, editable=False, null=True, verbose_name='寫入中的請求'),
+        ),
+    ]
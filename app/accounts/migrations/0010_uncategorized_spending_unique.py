@@ -0,0 +1,37 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:08
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # 同時寫入可能已經建立了重複的未分類列，合併成一列才能加上限制
+    MonthlyCategorySpending = apps.get_model('accounts', 'MonthlyCategorySpending')
+    rows = MonthlyCategorySpending.objects\
+        .using(schema_editor.connection.alias)\
+        .filter(category__isnull=True)
+    duplicates = rows\
+        .values('book', 'month')\
+        .annotate(count=Count('pk'), total=Sum('amount'))\
+        .filter(count__gt=1)
+
+    for duplicate in duplicates:
+        group = rows.filter(book=duplicate['book'], month=duplicate['month']).order_by('pk')
+        keep = group.first()
+        group.exclude(pk=keep.pk).delete()
+        group.filter(pk=keep.pk).update(amount=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_uploadsession_writer'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='monthlycategoryspending',
+            constraint=models.UniqueConstraint(condition=models.Q(category__isnull=True), fields=('book', 'month'), name='accounts_uncategorized_spending_unique'),
+        ),
+    ]
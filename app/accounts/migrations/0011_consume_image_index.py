@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_uncategorized_spending_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='consume',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_consume_image_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importbatch',
+            name='runner',
+            field=models.UUIDField(blank=True, editable=False, null=True, verbose_name='匯入中的請求'),
+        ),
+    ]
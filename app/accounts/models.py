@@ -1,21 +1,95 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
 import datetime
+import os
+import uuid
 
 User = get_user_model()
 
 
-class AccountBook(models.Model):
+class BookScopedQuerySet(models.QuerySet):
+    book_path = 'book'
+
+    def visible_to(self, user):
+        """
+        Limit the rows to the books the user is still a member of.
+
+        The membership lookup is compiled into a single subquery, so the cost
+        does not grow with the number of books the user has joined. Users
+        authenticated by token already list their books in a claim.
+        """
+        books = getattr(user, 'books', None)
+
+        if books is None:
+            books = Authority.objects\
+                .filter(user=user.pk)\
+                .exclude(authority=Authority.LEAVE)\
+                .values('book')
+
+        return self.filter(**{f'{self.book_path}__in': books})
+
+
+class CounterQuerySet(BookScopedQuerySet):
+    def increment(self, columns, **lookup):
+        """
+        Add ``columns`` to the row matching ``lookup``, creating it if needed.
+
+        The addition happens in the database with ``F()`` expressions, so
+        concurrent writers never overwrite each other's deltas.
+        """
+        changes = {column: models.F(column) + amount for column, amount in columns.items()}
+
+        if self.filter(**lookup).update(**changes):
+            return
+
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(**lookup, **columns)
+        except IntegrityError:
+            # 其他交易剛好建立了同一列
+            self.filter(**lookup).update(**changes)
+
+
+class AtomicSaveMixin:
+    def save(self, *args, **kwargs):
+        # post_save 的衍生資料（餘額等）與本筆資料在同一個交易中寫入
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class AccountBookQuerySet(BookScopedQuerySet):
+    book_path = 'pk'
+
+
+class ProportionQuerySet(BookScopedQuerySet):
+    book_path = 'consume__book'
+
+
+class AccountBook(AtomicSaveMixin, models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField('詳細資訊', blank=True)
+    sequence = models.BigIntegerField('變更序號', default=0, editable=False)
     create_at = models.DateTimeField('建立時間', auto_now_add=True)
     update_at = models.DateTimeField('更新時間', auto_now=True)
 
+    objects = AccountBookQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # 變更序號只能由 changes.record 以 F() 遞增，避免被舊值覆蓋
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'sequence'
+            ]
+
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
 
-class Authority(models.Model):
+class Authority(AtomicSaveMixin, models.Model):
     CREATOR, WRITER, READER, LEAVE = range(4)
     STATUS_CHOICES = (
         (CREATOR, 'creator'),
@@ -31,6 +105,8 @@ class Authority(models.Model):
     authority = models.PositiveIntegerField(
         choices=STATUS_CHOICES, default=CREATOR)
 
+    objects = BookScopedQuerySet.as_manager()
+
     class Meta:
         unique_together = (
             ('user', 'book'),
@@ -40,11 +116,13 @@ class Authority(models.Model):
         return f'{self.user} has {self.authority} on {self.book}.'
 
 
-class Category(models.Model):
+class Category(AtomicSaveMixin, models.Model):
     name = models.CharField(max_length=255)
     book = models.ForeignKey(AccountBook, on_delete=models.CASCADE,
                              verbose_name='所屬帳簿', related_name='category')
 
+    objects = BookScopedQuerySet.as_manager()
+
     class Meta:
         unique_together = (
             ('name', 'book'),
@@ -54,7 +132,7 @@ class Category(models.Model):
         return self.name
 
 
-class Consume(models.Model):
+class Consume(AtomicSaveMixin, models.Model):
     name = models.CharField(max_length=255)
     note = models.TextField('備註', blank=True)
     creator = models.ForeignKey(
@@ -63,24 +141,34 @@ class Consume(models.Model):
         Category, models.SET_DEFAULT, null=True, blank=True, default=None, verbose_name='分類')
     book = models.ForeignKey(
         AccountBook, on_delete=models.CASCADE, verbose_name='所屬帳簿', related_name='consume')
-    image = models.ImageField(blank=True)
+    image = models.ImageField(blank=True, db_index=True)
     is_repay = models.BooleanField(default=False)
     description = models.TextField('詳細資訊', blank=True)
     consume_at = models.DateField('消費日', default=datetime.date.today)
     create_at = models.DateTimeField('建立時間', auto_now_add=True)
     update_at = models.DateTimeField('更新時間', auto_now=True)
 
+    objects = BookScopedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'consume_at', 'id']),
+            models.Index(fields=['book', 'is_repay']),
+        ]
+
     def __str__(self):
         return self.name
 
 
-class Proportion(models.Model):
+class Proportion(AtomicSaveMixin, models.Model):
     username = models.ForeignKey(
         User, on_delete=models.CASCADE, verbose_name='付款人', related_name='percent')
     fee = models.PositiveIntegerField('費用')
     consume = models.ForeignKey(
         Consume, on_delete=models.CASCADE, verbose_name='消費明細', related_name='list')
 
+    objects = ProportionQuerySet.as_manager()
+
     class Meta:
         unique_together = (
             ('username', 'consume'),
@@ -88,3 +176,146 @@ class Proportion(models.Model):
 
     def __str__(self):
         return f'{self.username} spent {self.fee}.'
+
+
+class BookBalance(models.Model):
+    book = models.ForeignKey(
+        AccountBook, on_delete=models.CASCADE, verbose_name='帳本', related_name='balance')
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='使用者', related_name='balance')
+    paid = models.BigIntegerField('代墊', default=0)
+    owed = models.BigIntegerField('應付', default=0)
+    sent = models.BigIntegerField('已還款', default=0)
+    received = models.BigIntegerField('已收款', default=0)
+
+    objects = CounterQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (
+            ('book', 'user'),
+        )  # 合在一起為pk
+
+    @property
+    def balance(self):
+        """Positive when the other members owe the user money."""
+        return self.paid - self.owed + self.sent - self.received
+
+    def __str__(self):
+        return f'{self.user} has {self.balance} on {self.book}.'
+
+
+class ImportBatch(models.Model):
+    book = models.ForeignKey(
+        AccountBook, on_delete=models.CASCADE, verbose_name='帳本', related_name='imports')
+    key = models.CharField('冪等鍵', max_length=64)
+    rows = models.PositiveIntegerField('已處理筆數', default=0)
+    created = models.PositiveIntegerField('已新增筆數', default=0)
+    errors = models.TextField('錯誤', blank=True)
+    finished = models.BooleanField(default=False)
+    runner = models.UUIDField('匯入中的請求', null=True, blank=True, editable=False)
+    create_at = models.DateTimeField('建立時間', auto_now_add=True)
+    update_at = models.DateTimeField('更新時間', auto_now=True)
+
+    class Meta:
+        unique_together = (
+            ('book', 'key'),
+        )  # 合在一起為pk
+
+    def __str__(self):
+        return f'{self.key} on {self.book}.'
+
+
+class MonthlyCategorySpending(models.Model):
+    book = models.ForeignKey(
+        AccountBook, on_delete=models.CASCADE, verbose_name='帳本', related_name='category_spending')
+    month = models.DateField('月份')
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, null=True, blank=True, verbose_name='分類')
+    amount = models.BigIntegerField('金額', default=0)
+
+    objects = CounterQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (
+            ('book', 'month', 'category'),
+        )  # 合在一起為pk
+        constraints = [
+            # NULL 不算重複，未分類的要另外限制
+            models.UniqueConstraint(
+                fields=['book', 'month'],
+                condition=models.Q(category__isnull=True),
+                name='accounts_uncategorized_spending_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.category} spent {self.amount} in {self.month:%Y-%m}.'
+
+
+class MonthlyPayerSpending(models.Model):
+    book = models.ForeignKey(
+        AccountBook, on_delete=models.CASCADE, verbose_name='帳本', related_name='payer_spending')
+    month = models.DateField('月份')
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='付款人', related_name='monthly_paid')
+    amount = models.BigIntegerField('金額', default=0)
+
+    objects = CounterQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (
+            ('book', 'month', 'user'),
+        )  # 合在一起為pk
+
+    def __str__(self):
+        return f'{self.user} paid {self.amount} in {self.month:%Y-%m}.'
+
+
+class Change(models.Model):
+    CREATED, UPDATED, DELETED = range(3)
+    ACTION_CHOICES = (
+        (CREATED, 'created'),
+        (UPDATED, 'updated'),
+        (DELETED, 'deleted'),
+    )
+
+    book = models.ForeignKey(
+        AccountBook, on_delete=models.CASCADE, verbose_name='帳本', related_name='changes')
+    sequence = models.BigIntegerField('變更序號')
+    model = models.CharField('資料表', max_length=32)
+    object_id = models.PositiveIntegerField('資料編號')
+    action = models.PositiveSmallIntegerField(choices=ACTION_CHOICES)
+    create_at = models.DateTimeField('建立時間', auto_now_add=True)
+
+    class Meta:
+        unique_together = (
+            ('book', 'sequence'),
+        )  # 合在一起為pk
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} {self.get_action_display()} on {self.book_id}.'
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='使用者', related_name='uploads')
+    filename = models.CharField('檔名', max_length=255)
+    size = models.PositiveIntegerField('檔案大小')
+    received = models.PositiveIntegerField('已接收大小', default=0)
+    writer = models.UUIDField('寫入中的請求', null=True, blank=True, editable=False)
+    consume = models.ForeignKey(
+        Consume, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='消費', related_name='+')
+    create_at = models.DateTimeField('建立時間', auto_now_add=True)
+    update_at = models.DateTimeField('更新時間', auto_now=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_SESSION_DIR, f'{self.pk}.part')
+
+    @property
+    def finished(self):
+        return self.consume_id is not None
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size}) by {self.user}.'
@@ -0,0 +1,174 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique composite ordering.
+
+    The cursor stores the ordering values of the last row of the page and the
+    next page is selected with ``WHERE (a, b) > (x, y)`` style filters, so a
+    page costs the same however deep the client has scrolled, as long as an
+    index matches ``ordering``.
+    """
+    ordering = ('-id',)
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request, queryset.model)
+        ordering = self.ordering
+
+        if cursor is None:
+            self.reverse, position = False, None
+        else:
+            self.reverse, position = cursor
+
+        if self.reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+
+        queryset = queryset.order_by(*ordering)
+
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        return self.encode_cursor(False, self.position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+
+        return self.encode_cursor(True, self.position(self.page[0]))
+
+    def position(self, row):
+        return [self.value(row, field.lstrip('-')) for field in self.ordering]
+
+    def value(self, row, field):
+        if isinstance(row, dict):
+            value = row[field]
+        else:
+            value = row
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+
+        return value if isinstance(value, (int, type(None))) else str(value)
+
+    def encode_cursor(self, reverse, position):
+        cursor = json.dumps([int(reverse), position], separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(cursor.encode()).decode()
+
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        if cursor is None:
+            return None
+
+        try:
+            reverse, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            assert isinstance(position, list) and len(position) == len(self.ordering)
+            # 型別不對的值到了 filter 才會出錯，先照欄位轉換
+            position = [
+                self.to_python(model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, AssertionError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return bool(reverse), position
+
+    def to_python(self, model, field, value):
+        *relations, name = field.split('__')
+
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+
+        if value is None:
+            raise ValueError(value)
+
+        return model._meta.get_field(name).to_python(value)
+
+    def after(self, ordering, position):
+        """Rows strictly after ``position`` in ``ordering``."""
+        condition = Q()
+
+        for index in reversed(range(len(ordering))):
+            field = ordering[index]
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                ordering[i].lstrip('-'): position[i] for i in range(index)
+            }
+            condition |= Q(**equal, **{f'{name}__{lookup}': position[index]})
+
+        return condition
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class ConsumePagination(KeysetPagination):
+    ordering = ('-consume_at', '-id')
+
+
+class ProportionPagination(KeysetPagination):
+    ordering = ('id',)
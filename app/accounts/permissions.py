@@ -1,6 +1,57 @@
 from rest_framework import permissions
 
+from .models import AccountBook, Authority, Proportion
+
+
+WRITERS = (Authority.CREATOR, Authority.WRITER)
+
+
+def roles_of(user, books):
+    """
+    Role of the user in each of the given books they are a member of.
+
+    Users authenticated by token carry their roles as a claim, so only
+    session users need a query.
+    """
+    claims = getattr(user, 'books', None)
+
+    if claims is not None:
+        return {book: claims[book] for book in books if book in claims}
+
+    return dict(Authority.objects
+                .filter(user=user.pk, book__in=books)
+                .exclude(authority=Authority.LEAVE)
+                .values_list('book', 'authority'))
+
+
+def role_of(user, book):
+    return roles_of(user, [book]).get(book)
+
+
+def book_of(obj):
+    if isinstance(obj, AccountBook):
+        return obj.pk
+    if isinstance(obj, Proportion):
+        return obj.consume.book_id
+
+    return obj.book_id
+
 
 class IsCurrentUser(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return bool(request.user and request.user == obj.user)
+        return bool(request.user and request.user.pk == obj.user_id)
+
+
+class IsBookWriter(permissions.BasePermission):
+    message = 'Only creators and writers can change the book.'
+
+    def has_object_permission(self, request, view, obj):
+        return role_of(request.user, book_of(obj)) in WRITERS
+
+
+class IsBookWriterOrReadOnly(IsBookWriter):
+    """Readers only get the rows ``visible_to`` already limits to members."""
+
+    def has_object_permission(self, request, view, obj):
+        return request.method in permissions.SAFE_METHODS or \
+            super().has_object_permission(request, view, obj)
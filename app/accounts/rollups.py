@@ -0,0 +1,122 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from .models import MonthlyCategorySpending, MonthlyPayerSpending, Proportion
+
+
+def rollup_deltas(rows):
+    categories = defaultdict(int)
+    payers = defaultdict(int)
+
+    for row in rows:
+        # 還款不算支出
+        if row['is_repay']:
+            continue
+
+        categories[row['book'], row['month'], row['category']] += row['fee']
+        payers[row['book'], row['month'], row['creator']] += row['fee']
+
+    return categories, payers
+
+
+def apply(rows, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) ledger rows from the rollups."""
+    categories, payers = rollup_deltas(rows)
+
+    for (book, month, category), amount in categories.items():
+        if amount:
+            MonthlyCategorySpending.objects.increment(
+                {'amount': amount * sign},
+                book_id=book, month=month, category_id=category)
+
+    for (book, month, user), amount in payers.items():
+        if amount:
+            MonthlyPayerSpending.objects.increment(
+                {'amount': amount * sign},
+                book_id=book, month=month, user_id=user)
+
+
+def move_category(category, rollups):
+    """Fold the rollups of a deleted category into the uncategorized ones."""
+    for month, amount in rollups:
+        if amount:
+            MonthlyCategorySpending.objects.increment(
+                {'amount': amount},
+                book_id=category.book_id, month=month, category_id=None)
+
+
+def compute(books):
+    """Aggregate the rollups of the given books from the raw proportions."""
+    proportions = Proportion.objects\
+        .filter(consume__book__in=books, consume__is_repay=False)\
+        .annotate(month=TruncMonth('consume__consume_at'))
+    categories = {
+        (row['consume__book'], row['month'], row['consume__category']): row['total']
+        for row in proportions
+        .values('consume__book', 'month', 'consume__category')
+        .annotate(total=Sum('fee')).order_by()
+    }
+    payers = {
+        (row['consume__book'], row['month'], row['consume__creator']): row['total']
+        for row in proportions
+        .values('consume__book', 'month', 'consume__creator')
+        .annotate(total=Sum('fee')).order_by()
+    }
+
+    return categories, payers
+
+
+def stored(books):
+    categories = defaultdict(int)
+    payers = defaultdict(int)
+
+    for book, month, category, amount in MonthlyCategorySpending.objects\
+            .filter(book__in=books)\
+            .values_list('book', 'month', 'category', 'amount'):
+        categories[book, month, category] += amount
+
+    for book, month, user, amount in MonthlyPayerSpending.objects\
+            .filter(book__in=books)\
+            .values_list('book', 'month', 'user', 'amount'):
+        payers[book, month, user] += amount
+
+    return categories, payers
+
+
+def rebuild(books):
+    """Replace the stored rollups of the given books, returns the mismatches."""
+    categories, payers = compute(books)
+    mismatches = verify(books, (categories, payers))
+
+    with transaction.atomic():
+        MonthlyCategorySpending.objects.filter(book__in=books).delete()
+        MonthlyPayerSpending.objects.filter(book__in=books).delete()
+        MonthlyCategorySpending.objects.bulk_create(
+            MonthlyCategorySpending(
+                book_id=book, month=month, category_id=category, amount=amount)
+            for (book, month, category), amount in categories.items()
+        )
+        MonthlyPayerSpending.objects.bulk_create(
+            MonthlyPayerSpending(book_id=book, month=month, user_id=user, amount=amount)
+            for (book, month, user), amount in payers.items()
+        )
+
+    return mismatches
+
+
+def verify(books, expected=None):
+    """Compare the stored rollups with freshly aggregated ones."""
+    if expected is None:
+        expected = compute(books)
+
+    mismatches = []
+
+    for kind, actual, computed in zip(('category', 'payer'), stored(books), expected):
+        for key in set(actual) | set(computed):
+            if actual.get(key, 0) != computed.get(key, 0):
+                mismatches.append((kind, key, actual.get(key, 0), computed.get(key, 0)))
+
+    return sorted(mismatches, key=str)
@@ -0,0 +1,163 @@
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+
+from rest_framework import ISO_8601, fields, relations
+from rest_framework.settings import api_settings
+
+
+# 資料庫讀出來的值已經是 to_representation 的結果，直接沿用
+IDENTITY = (fields.BooleanField, fields.CharField, fields.IntegerField, fields.ReadOnlyField)
+# to_representation 只看值本身，不需要 model 物件
+SCALAR = (
+    fields.ChoiceField,
+    fields.DateField,
+    fields.DateTimeField,
+    fields.DecimalField,
+    fields.DurationField,
+    fields.FloatField,
+    fields.TimeField,
+    fields.UUIDField,
+)
+
+
+class Unsupported(Exception):
+    pass
+
+
+def datetime_converter(field):
+    """
+    ``field.to_representation`` for aware datetimes in ISO 8601.
+
+    DRF looks up the current time zone for every value, here it is looked up
+    once, when the row serializer is built for the request.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, str) or not timezone.is_aware(value):
+            return field.to_representation(value)
+
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+def field_converter(serializer, field, model):
+    """
+    ``(column, convert, method)`` reproducing how ``field`` renders a row.
+
+    Exactly one of ``convert`` (called with the column value) and ``method``
+    (called with the whole row) may be set, neither means the value is
+    copied as it is.
+    """
+    if isinstance(field, fields.SerializerMethodField):
+        return None, None, getattr(serializer, field.method_name)
+
+    if '.' in field.source or field.source == '*':
+        raise Unsupported(field.field_name)
+
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        raise Unsupported(field.field_name)
+
+    if not model_field.concrete or model_field.many_to_many:
+        raise Unsupported(field.field_name)
+
+    if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None:
+        return field.source, None, None
+    if isinstance(field, fields.FileField):
+        return field.source, lambda name: field.to_representation(
+            model_field.attr_class(None, model_field, name)), None
+    if isinstance(field, IDENTITY):
+        return field.source, None, None
+    if isinstance(field, fields.DateTimeField):
+        return field.source, datetime_converter(field), None
+    if isinstance(field, SCALAR):
+        return field.source, field.to_representation, None
+
+    raise Unsupported(field.field_name)
+
+
+class RowSerializer:
+    """
+    Render ``.values()`` rows like a model serializer renders instances.
+
+    The converters are taken from the fields of the serializer once, so
+    rows skip building model instances and the per-field attribute lookup,
+    while the output keeps the same keys, order and formats. Method fields
+    receive a row object with the column values as attributes and file
+    columns as ``FieldFile``.
+    """
+
+    def __init__(self, serializer):
+        model = serializer.Meta.model
+        self.fields = []
+        self.files = {}
+        columns = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+
+            column, convert, method = field_converter(serializer, field, model)
+            self.fields.append((name, column, convert, method))
+
+            if column is not None:
+                columns.append(column)
+
+        self.has_methods = any(method for _, _, _, method in self.fields)
+
+        if self.has_methods:
+            # 方法欄位不知道會用到哪些欄位，全部讀出來
+            for model_field in model._meta.concrete_fields:
+                columns.append(model_field.name)
+
+                if isinstance(model_field, models.FileField):
+                    self.files[model_field.name] = model_field
+
+        self.columns = list(dict.fromkeys(columns))
+
+    def row_object(self, row):
+        obj = SimpleNamespace(**row)
+
+        for name, model_field in self.files.items():
+            setattr(obj, name, model_field.attr_class(obj, model_field, row[name]))
+
+        return obj
+
+    def to_representation(self, rows):
+        fields = self.fields
+        data = []
+
+        for row in rows:
+            obj = self.row_object(row) if self.has_methods else None
+            item = {}
+
+            for name, column, convert, method in fields:
+                if method is not None:
+                    item[name] = method(obj)
+                    continue
+
+                value = row[column]
+                item[name] = value if convert is None or value is None else convert(value)
+
+            data.append(item)
+
+        return data
+
+
+def build(serializer):
+    """A ``RowSerializer`` for the serializer, or ``None`` if it cannot be built."""
+    try:
+        return RowSerializer(serializer)
+    except Unsupported:
+        return None
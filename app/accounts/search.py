@@ -0,0 +1,186 @@
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Consume
+
+
+TABLE = 'accounts_consume_fts'
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN = re.compile(rf'[{CJK}]+|(?:(?![{CJK}])[^\W_])+')
+IS_CJK = re.compile(rf'[{CJK}]')
+
+
+def tokens(text):
+    """
+    Split text into index tokens.
+
+    Words are lower-cased as they are. Chinese, Japanese and Korean text has
+    no spaces between words, so every character and every pair of adjacent
+    characters becomes a token instead.
+    """
+    for match in TOKEN.finditer(text.lower()):
+        run = match.group()
+
+        if IS_CJK.match(run):
+            yield from run
+            yield from (run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            yield run
+
+
+def query_terms(text):
+    """``(term, prefix)`` pairs that must all match for a search."""
+    for match in TOKEN.finditer(text.lower()):
+        run = match.group()
+
+        if not IS_CJK.match(run):
+            yield run, True
+        elif len(run) == 1:
+            yield run, False
+        else:
+            yield from ((run[i:i + 2], False) for i in range(len(run) - 1))
+
+
+def document(name, note, description, category):
+    return ' '.join(tokens(' '.join(filter(None, [name, note, description, category]))))
+
+
+def consume_documents(consumes):
+    """``(consume, book, document)`` of the given consumes, in one query."""
+    return [
+        (pk, book, document(name, note, description, category))
+        for pk, book, name, note, description, category in Consume.objects
+        .filter(pk__in=consumes)
+        .values_list('pk', 'book', 'name', 'note', 'description', 'category__name')
+    ]
+
+
+class SQLiteIndex:
+    create = [
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5(document, book UNINDEXED, tokenize='unicode61')",
+    ]
+    drop = [f'DROP TABLE {TABLE}']
+
+    @staticmethod
+    def match(terms):
+        return f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [' '.join(
+            f'"{term}"*' if prefix else f'"{term}"' for term, prefix in terms
+        )]
+
+    @staticmethod
+    def insert(cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, book, document) VALUES (%s, %s, %s)', rows)
+
+
+class PostgreSQLIndex:
+    create = [
+        f'CREATE TABLE {TABLE} (rowid integer PRIMARY KEY, book integer NOT NULL, document tsvector NOT NULL)',
+        f'CREATE INDEX {TABLE}_document ON {TABLE} USING gin (document)',
+        f'CREATE INDEX {TABLE}_book ON {TABLE} (book)',
+    ]
+    drop = [f'DROP TABLE {TABLE}']
+
+    @staticmethod
+    def match(terms):
+        return f"SELECT rowid FROM {TABLE} WHERE document @@ to_tsquery('simple', %s)", [' & '.join(
+            f"'{term}':*" if prefix else f"'{term}'" for term, prefix in terms
+        )]
+
+    @staticmethod
+    def insert(cursor, rows):
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, book, document) VALUES (%s, %s, to_tsvector('simple', %s))",
+            rows)
+
+
+BACKENDS = {
+    'sqlite': SQLiteIndex,
+    'postgresql': PostgreSQLIndex,
+}
+
+
+def backend(using=None):
+    return BACKENDS.get(connections[using or router.db_for_write(Consume)].vendor)
+
+
+def index(consumes):
+    """Write the search documents of the given consumes."""
+    consumes = list(consumes)
+    fts = backend()
+
+    if fts is None or not consumes:
+        return
+
+    rows = consume_documents(consumes)
+
+    with connections[router.db_for_write(Consume)].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE rowid IN ({", ".join(["%s"] * len(consumes))})',
+            consumes)
+        fts.insert(cursor, rows)
+
+
+def remove(consumes=(), book=None):
+    consumes = list(consumes)
+
+    if backend() is None or not (consumes or book):
+        return
+
+    with connections[router.db_for_write(Consume)].cursor() as cursor:
+        if book is not None:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE book = %s', [book])
+        else:
+            cursor.execute(
+                f'DELETE FROM {TABLE} WHERE rowid IN ({", ".join(["%s"] * len(consumes))})',
+                consumes)
+
+
+def rebuild(books, batch_size=1000):
+    """Index every consume of the given books again."""
+    for book in books:
+        remove(book=book)
+        consumes = list(Consume.objects
+                        .filter(book=book)
+                        .order_by('pk')
+                        .values_list('pk', flat=True))
+
+        for start in range(0, len(consumes), batch_size):
+            index(consumes[start:start + batch_size])
+
+
+def search(queryset, text):
+    """
+    Filter consumes to the ones matching every term of ``text``.
+
+    Backends without a text index fall back to ``icontains``, which scans
+    the whole table.
+    """
+    terms = list(query_terms(text))
+
+    if not terms:
+        return queryset
+
+    fts = backend(queryset.db)
+
+    if fts is None:
+        condition = Q()
+        for word in text.split():
+            condition &= Q(name__icontains=word) | Q(note__icontains=word) | \
+                Q(description__icontains=word) | Q(category__name__icontains=word)
+
+        return queryset.filter(condition)
+
+    return queryset.filter(pk__in=RawSQL(*fts.match(terms)))
+
+
+class SearchFilter(BaseFilterBackend):
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        return search(queryset, request.query_params.get(self.search_param, ''))
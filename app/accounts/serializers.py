@@ -1,6 +1,26 @@
+import datetime
+
+from django.conf import settings
+
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
-from .models import AccountBook, Authority, Category, Consume, Proportion
+from app.users.serializers import UserSerializer
+from core import images
+
+from .bulk import create_consumes
+from .permissions import WRITERS, roles_of
+from .models import (
+    AccountBook,
+    Authority,
+    BookBalance,
+    Category,
+    Consume,
+    MonthlyCategorySpending,
+    MonthlyPayerSpending,
+    Proportion,
+    UploadSession,
+)
 
 
 class AccountBookSerializer(serializers.ModelSerializer):
@@ -29,12 +49,200 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class ConsumeSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Consume
         fields = '__all__'
 
+    def get_image_variants(self, instance):
+        return images.variant_urls(instance.image)
+
 
 class ProportionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Proportion
         fields = '__all__'
+
+
+class NestedConsumeSerializer(ConsumeSerializer):
+    proportions = ProportionSerializer(source='list', many=True, read_only=True)
+
+
+class MemberSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Authority
+        fields = ('id', 'user', 'authority')
+
+
+class BookSnapshotSerializer(AccountBookSerializer):
+    """
+    A book with everything needed to open it.
+
+    The nested lists read the relations prefetched by the view, ``expand``
+    leaves out the ones the client does not need.
+    """
+    EXPANSIONS = ('categories', 'members', 'consumes')
+
+    categories = CategorySerializer(source='category', many=True, read_only=True)
+    members = MemberSerializer(many=True, read_only=True)
+    consumes = NestedConsumeSerializer(source='consume', many=True, read_only=True)
+
+    def __init__(self, *args, expand=EXPANSIONS, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        for name in set(self.EXPANSIONS) - set(expand):
+            self.fields.pop(name)
+
+
+class SplitSerializer(serializers.Serializer):
+    username = serializers.IntegerField()
+    fee = serializers.IntegerField(min_value=0)
+
+
+class BulkConsumeListSerializer(serializers.ListSerializer):
+    max_length = 500
+
+    def to_internal_value(self, data):
+        """
+        Check every consume of the batch with a fixed number of queries.
+
+        The related fields are plain ids, so instead of one lookup per field
+        and row, the books, members and categories are fetched once for the
+        whole batch.
+        """
+        if isinstance(data, list) and len(data) > self.max_length:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f'Ensure this field has no more than {self.max_length} elements.',
+                ],
+            })
+
+        attrs = super().to_internal_value(data)
+        user = self.context['request'].user
+        books = {item['book'] for item in attrs}
+        categories = {item['category'] for item in attrs} - {None}
+
+        writable = {
+            book for book, role in roles_of(user, books).items() if role in WRITERS
+        }
+        members = set(Authority.objects
+                      .filter(book__in=writable)
+                      .exclude(authority=Authority.LEAVE)
+                      .values_list('book', 'user'))
+        category_books = dict(Category.objects
+                              .filter(pk__in=categories)
+                              .values_list('pk', 'book')) if categories else {}
+
+        errors = []
+        for item in attrs:
+            error = {}
+            book = item['book']
+            usernames = [split['username'] for split in item['proportions']]
+
+            if book not in writable:
+                error['book'] = ['Cannot post.']
+            elif (book, item['creator']) not in members:
+                error['creator'] = ['Not a member of the book.']
+
+            if item['category'] is not None and category_books.get(item['category']) != book:
+                error['category'] = ['Not a category of the book.']
+
+            if book in writable and any((book, username) not in members for username in usernames):
+                error['proportions'] = ['Not a member of the book.']
+            elif len(set(usernames)) != len(usernames):
+                error['proportions'] = ['Duplicated member.']
+
+            errors.append(error)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return attrs
+
+    def create(self, validated_data):
+        consumes = [
+            Consume(
+                name=item['name'],
+                note=item['note'],
+                creator_id=item['creator'],
+                category_id=item['category'],
+                book_id=item['book'],
+                is_repay=item['is_repay'],
+                description=item['description'],
+                consume_at=item['consume_at'],
+            ) for item in validated_data
+        ]
+
+        return create_consumes(consumes, [
+            [
+                Proportion(username_id=split['username'], fee=split['fee'])
+                for split in item['proportions']
+            ] for item in validated_data
+        ])
+
+
+class BulkConsumeSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    note = serializers.CharField(allow_blank=True, default='')
+    creator = serializers.IntegerField()
+    category = serializers.IntegerField(allow_null=True, default=None)
+    book = serializers.IntegerField()
+    is_repay = serializers.BooleanField(default=False)
+    description = serializers.CharField(allow_blank=True, default='')
+    consume_at = serializers.DateField(default=datetime.date.today)
+    proportions = SplitSerializer(many=True)
+
+    class Meta:
+        list_serializer_class = BulkConsumeListSerializer
+
+
+class BookBalanceSerializer(serializers.ModelSerializer):
+    balance = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = BookBalance
+        fields = ('user', 'paid', 'owed', 'sent', 'received', 'balance')
+
+
+class TransferSerializer(serializers.Serializer):
+    payer = serializers.IntegerField()
+    payee = serializers.IntegerField()
+    amount = serializers.IntegerField()
+
+
+class CategorySpendingSerializer(serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m')
+    name = serializers.CharField(source='category.name', default=None)
+
+    class Meta:
+        model = MonthlyCategorySpending
+        fields = ('month', 'category', 'name', 'amount')
+
+
+class PayerSpendingSerializer(serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m')
+
+    class Meta:
+        model = MonthlyPayerSpending
+        fields = ('month', 'user', 'amount')
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'received', 'consume', 'create_at', 'update_at')
+        read_only_fields = ('received', 'consume')
+
+    def validate_size(self, value):
+        if value > settings.UPLOAD_SESSION_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Ensure this value is less than or equal to {settings.UPLOAD_SESSION_MAX_SIZE}.')
+
+        return value
+
+
+class FinalizeUploadSerializer(serializers.Serializer):
+    consume = serializers.IntegerField()
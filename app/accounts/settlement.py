@@ -0,0 +1,44 @@
+import heapq
+
+from .models import BookBalance
+
+
+def net_positions(book):
+    """Net amount per member, positive when the member should be paid back."""
+    return {
+        balance.user_id: balance.balance
+        for balance in BookBalance.objects.filter(book=book)
+        if balance.balance
+    }
+
+
+def simplify(positions):
+    """
+    Greedily match the largest creditor with the largest debtor.
+
+    Every round settles at least one member, so there are fewer transfers
+    than members and the heaps keep the whole run in O(n log n).
+    """
+    creditors = [(-amount, user) for user, amount in positions.items() if amount > 0]
+    debtors = [(amount, user) for user, amount in positions.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers = []
+
+    while creditors and debtors:
+        credit, payee = heapq.heappop(creditors)
+        debt, payer = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+
+        transfers.append({
+            'payer': payer,
+            'payee': payee,
+            'amount': amount,
+        })
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, payee))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, payer))
+
+    return transfers
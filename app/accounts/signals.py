@@ -0,0 +1,303 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from core import images
+
+from . import changes, ledger, rollups, search, tokens
+from .ledger import consume_row
+from .models import (
+    AccountBook,
+    Authority,
+    Category,
+    Change,
+    Consume,
+    MonthlyCategorySpending,
+    Proportion,
+)
+
+
+# bulk_create 不會送出 post_save，批次新增完成後改送這個訊號
+consumes_created = Signal()
+
+# 刪除中的帳本與消費，避免連鎖刪除時逐筆查詢或更新即將消失的統計
+_state = threading.local()
+
+
+def _deleting_books():
+    if not hasattr(_state, 'books'):
+        _state.books = set()
+
+    return _state.books
+
+
+def _deleting_consumes():
+    if not hasattr(_state, 'consumes'):
+        _state.consumes = {}
+
+    return _state.consumes
+
+
+def _in_bulk():
+    return getattr(_state, 'bulk', 0) > 0
+
+
+@contextmanager
+def bulk_insert():
+    """
+    Skip the per-row change log while rows are inserted in bulk.
+
+    Callers send ``consumes_created`` once the batch is written, which logs
+    the whole batch with a single sequence bump.
+    """
+    _state.bulk = getattr(_state, 'bulk', 0) + 1
+
+    try:
+        yield
+    finally:
+        _state.bulk -= 1
+
+
+def book_of(instance):
+    if isinstance(instance, AccountBook):
+        return instance.pk
+
+    if isinstance(instance, Proportion):
+        row = _deleting_consumes().get(instance.consume_id)
+
+        return row['book'] if row else instance.consume.book_id
+
+    return instance.book_id
+
+
+@receiver(pre_save, sender=Proportion)
+def remember_proportion(sender, instance, raw=False, **kwargs):
+    instance._ledger_rows = []
+
+    if raw or instance._state.adding or instance.pk is None:
+        return
+
+    instance._ledger_rows = ledger.proportion_rows(
+        Proportion.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Proportion)
+def update_proportion(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    ledger.apply(getattr(instance, '_ledger_rows', []), -1)
+    ledger.apply([consume_row(
+        instance.consume,
+        user=instance.username_id,
+        fee=instance.fee,
+    )])
+
+
+@receiver(post_delete, sender=Proportion)
+def delete_proportion(sender, instance, **kwargs):
+    row = _deleting_consumes().get(instance.consume_id)
+
+    if row is None:
+        row = consume_row(instance.consume)
+
+    if row['book'] in _deleting_books():
+        return
+
+    ledger.apply([dict(row, user=instance.username_id, fee=instance.fee)], -1)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_deleted_category(sender, instance, **kwargs):
+    # 分類刪除後消費會改成未分類，先記下原本的統計與受影響的消費
+    instance._rollups = list(MonthlyCategorySpending.objects
+                             .filter(category=instance)
+                             .values_list('month', 'amount'))
+    instance._consumes = list(Consume.objects
+                              .filter(category=instance)
+                              .values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def move_deleted_category(sender, instance, **kwargs):
+    if instance.book_id in _deleting_books():
+        return
+
+    rollups.move_category(instance, getattr(instance, '_rollups', []))
+    changes.record(
+        instance.book_id, Consume, getattr(instance, '_consumes', []), Change.UPDATED)
+    search.index(getattr(instance, '_consumes', []))
+
+
+@receiver(post_save, sender=Category)
+def index_renamed_category(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        search.index(Consume.objects
+                     .filter(category=instance)
+                     .values_list('pk', flat=True))
+
+
+def moved(consume):
+    """Whether the last save moved ``consume`` to another book."""
+    return getattr(consume, '_old_book', None) not in (None, consume.book_id)
+
+
+@receiver(pre_save, sender=Consume)
+def remember_consume(sender, instance, raw=False, **kwargs):
+    instance._ledger_rows = []
+
+    if raw or instance._state.adding or instance.pk is None:
+        return
+
+    old = Consume.objects\
+        .filter(pk=instance.pk)\
+        .only('book', 'creator', 'is_repay', 'category', 'consume_at')\
+        .first()
+
+    instance._old_book = old.book_id if old else None
+
+    if old and consume_row(old) != consume_row(instance):
+        instance._ledger_rows = ledger.proportion_rows(
+            Proportion.objects.filter(consume=instance))
+
+
+@receiver(post_save, sender=Consume)
+def update_consume(sender, instance, raw=False, **kwargs):
+    old_book = getattr(instance, '_old_book', None)
+    old_rows = getattr(instance, '_ledger_rows', [])
+
+    if not raw and moved(instance):
+        # 移到其他帳本：對原帳本等同刪除，對新帳本等同新增，分攤跟著消費走
+        proportions = list(Proportion.objects
+                           .filter(consume=instance)
+                           .order_by('pk')
+                           .values_list('pk', flat=True))
+        changes.record(old_book, Proportion, proportions, Change.DELETED)
+        changes.record(old_book, Consume, [instance.pk], Change.DELETED)
+        changes.record(instance.book_id, Consume, [instance.pk], Change.CREATED)
+        changes.record(instance.book_id, Proportion, proportions, Change.CREATED)
+
+    if not raw and not _in_bulk():
+        search.index([instance.pk])
+
+    if raw or not old_rows:
+        return
+
+    ledger.apply(old_rows, -1)
+    ledger.apply([
+        consume_row(instance, user=row['user'], fee=row['fee'])
+        for row in old_rows
+    ])
+
+
+@receiver(pre_delete, sender=Consume)
+def remember_deleted_consume(sender, instance, **kwargs):
+    _deleting_consumes()[instance.pk] = consume_row(instance)
+
+
+@receiver(post_delete, sender=Consume)
+def forget_deleted_consume(sender, instance, **kwargs):
+    _deleting_consumes().pop(instance.pk, None)
+
+    if instance.book_id not in _deleting_books():
+        search.remove([instance.pk])
+
+
+@receiver(pre_delete, sender=AccountBook)
+def remember_deleted_book(sender, instance, **kwargs):
+    _deleting_books().add(instance.pk)
+
+
+@receiver(post_delete, sender=AccountBook)
+def forget_deleted_book(sender, instance, **kwargs):
+    _deleting_books().discard(instance.pk)
+    search.remove(book=instance.pk)
+
+
+@receiver(consumes_created)
+def update_created_consumes(sender, consumes, proportions, **kwargs):
+    ledger.apply([
+        consume_row(
+            proportion.consume,
+            user=proportion.username_id,
+            fee=proportion.fee,
+        ) for proportion in proportions
+    ])
+
+    search.index(consume.pk for consume in consumes)
+
+    created = defaultdict(lambda: defaultdict(list))
+    for instance in [*consumes, *proportions]:
+        created[book_of(instance)][type(instance)].append(instance.pk)
+
+    for book, models in created.items():
+        for model, object_ids in models.items():
+            changes.record(book, model, object_ids, Change.CREATED)
+
+
+@receiver(pre_save, sender=Authority)
+def remember_authority(sender, instance, raw=False, **kwargs):
+    instance._old_authority = None
+
+    if not raw and not instance._state.adding and instance.pk is not None:
+        instance._old_authority = Authority.objects\
+            .filter(pk=instance.pk)\
+            .values_list('authority', flat=True)\
+            .first()
+
+
+@receiver(post_save, sender=Authority)
+def update_token_roles(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    old = getattr(instance, '_old_authority', None)
+    old = Authority.LEAVE if old is None else old
+
+    # 數字越小權限越大：降級或離開要撤銷舊憑證，加入或升級只需改查資料庫
+    if instance.authority > old:
+        tokens.bump_epoch(instance.user_id)
+    elif instance.authority < old:
+        tokens.bump_grants(instance.user_id)
+
+
+@receiver(post_delete, sender=Authority)
+def revoke_tokens(sender, instance, **kwargs):
+    # 帳本整本刪除時，憑證裡留著不存在的帳本也拿不到任何資料
+    if instance.authority != Authority.LEAVE and \
+            instance.book_id not in _deleting_books():
+        tokens.bump_epoch(instance.user_id)
+
+
+def record_saved(sender, instance, created, raw=False, **kwargs):
+    # 移到其他帳本的消費已經由 update_consume 記錄
+    if raw or _in_bulk() or sender is Consume and moved(instance):
+        return
+
+    sequence = changes.record(
+        book_of(instance),
+        sender,
+        [instance.pk],
+        Change.CREATED if created else Change.UPDATED,
+    )
+
+    if sender is AccountBook and sequence is not None:
+        instance.sequence = sequence
+
+
+def record_deleted(sender, instance, **kwargs):
+    book = book_of(instance)
+
+    if book not in _deleting_books():
+        changes.record(book, sender, [instance.pk], Change.DELETED)
+
+
+for model in (AccountBook, Authority, Category, Consume, Proportion):
+    post_save.connect(record_saved, sender=model)
+    post_delete.connect(record_deleted, sender=model)
+
+
+images.register(Consume, 'image')
@@ -0,0 +1,160 @@
+import asyncio
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from . import events
+from .permissions import role_of
+from .tokens import BookJWTAuthentication
+
+
+EVENTS_PATH = re.compile(r'^/accountbooks/(?P<book>\d+)/events$')
+KEEPALIVE = 15
+
+
+def token_of(scope):
+    """Access token from the ``Authorization`` header or ``?token=``."""
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            kind, _, token = value.decode('latin1').partition(' ')
+
+            if kind in api_settings.AUTH_HEADER_TYPES:
+                return token
+
+    # EventSource 無法帶 header，改由網址帶入
+    return parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+
+def authenticate(token):
+    """
+    ``(user, expiry)`` of an access token, or ``None``.
+
+    Tokens are checked like on every other request, so revoked tokens and
+    inactive users are rejected.
+    """
+    authentication = BookJWTAuthentication()
+
+    try:
+        validated_token = authentication.get_validated_token(token)
+        user = authentication.get_user(validated_token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+    return user, validated_token['exp']
+
+
+def member_of(token, book):
+    """``None`` for rejected tokens, otherwise whether the user is in ``book``."""
+    authenticated = authenticate(token)
+
+    if authenticated is None:
+        return None
+
+    return role_of(authenticated[0], book) is not None
+
+
+class BookEvents:
+    """
+    Stream the changes of a book as Server-Sent Events.
+
+    ``GET /accountbooks/{id}/events`` is served here and everything else is
+    passed to the wrapped Django application. Each event carries the book
+    sequence as its id, so clients fill gaps from ``changes?since=``.
+
+    The token is checked again on membership changes and keep-alives. The
+    stream ends with ``revoked`` once it is rejected or loses the book, and
+    with ``expired`` when it expires, so clients reconnect with a new one.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = EVENTS_PATH.match(scope['path']) if scope['type'] == 'http' else None
+
+        if match is None:
+            return await self.application(scope, receive, send)
+
+        book, token = int(match['book']), token_of(scope)
+        authenticated = await sync_to_async(authenticate)(token) if token else None
+        user, expiry = authenticated or (None, None)
+        role = user and await sync_to_async(role_of)(user, book)
+
+        if role is None:
+            status = 401 if user is None else 404
+            await send({'type': 'http.response.start', 'status': status, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        await self.stream(book, token, expiry, receive, send)
+
+    async def closing(self, token, book, expiry, check_member):
+        """The event ending the stream, once the token expired or lost the book."""
+        if time.time() >= expiry:
+            return {'event': 'expired'}
+
+        # 重新驗證憑證：撤銷、停用或離開帳本的連線就此結束
+        if check_member and not await sync_to_async(member_of)(token, book):
+            return {'event': 'revoked'}
+
+        return None
+
+    async def stream(self, book, token, expiry, receive, send):
+        broker = events.get_broker()
+        subscription = broker.subscribe(book)
+        disconnect = asyncio.ensure_future(receive())
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+
+        try:
+            while True:
+                message = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {message, disconnect},
+                    timeout=max(min(KEEPALIVE, expiry - time.time()), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if message not in done:
+                    message.cancel()
+
+                    if disconnect in done:
+                        return
+
+                    message = None
+
+                if message is not None:
+                    message = message.result()
+
+                closing = await self.closing(
+                    token, book, expiry,
+                    message is None or message.get('model') == 'authority')
+
+                if closing is not None:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': events.encode(closing),
+                        'more_body': False,
+                    })
+                    return
+
+                await send({
+                    'type': 'http.response.body',
+                    'body': b': keep-alive\n\n' if message is None else events.encode(message),
+                    'more_body': True,
+                })
+        finally:
+            broker.unsubscribe(book, subscription)
+            disconnect.cancel()
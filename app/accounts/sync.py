@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+from .models import AccountBook, Authority, Category, Change, Consume, Proportion
+from .serializers import (
+    AccountBookSerializer,
+    AuthoritySerializer,
+    CategorySerializer,
+    ConsumeSerializer,
+    ProportionSerializer,
+)
+
+
+SERIALIZERS = OrderedDict(
+    (model._meta.model_name, (model, serializer)) for model, serializer in [
+        (AccountBook, AccountBookSerializer),
+        (Authority, AuthoritySerializer),
+        (Category, CategorySerializer),
+        (Consume, ConsumeSerializer),
+        (Proportion, ProportionSerializer),
+    ]
+)
+
+
+def deltas(book, changes, context):
+    """
+    Turn a page of ``Change`` rows into the payload sent to clients.
+
+    Only the latest change of each object is kept. Objects that still exist
+    are sent with their current data, fetched with one query per model, and
+    everything else becomes a tombstone.
+    """
+    latest = OrderedDict()
+    for change in changes:
+        latest.pop((change.model, change.object_id), None)
+        latest[change.model, change.object_id] = change
+
+    data = {}
+    for name, (model, serializer) in SERIALIZERS.items():
+        object_ids = [
+            object_id for (model_name, object_id), change in latest.items()
+            if model_name == name and change.action != Change.DELETED
+        ]
+
+        if not object_ids:
+            continue
+
+        queryset = model.objects.all()
+        instances = queryset.filter(
+            pk__in=object_ids, **{queryset.book_path: book.pk})
+        for item in serializer(instances, many=True, context=context).data:
+            data[name, item['id']] = item
+
+    results = []
+    for key, change in latest.items():
+        item = data.get(key)
+
+        results.append(OrderedDict([
+            ('sequence', change.sequence),
+            ('model', change.model),
+            ('id', change.object_id),
+            ('action', Change.ACTION_CHOICES[Change.DELETED][1]
+             if item is None else change.get_action_display()),
+            ('data', item),
+        ]))
+
+    return results
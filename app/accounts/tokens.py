@@ -0,0 +1,178 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app.users.models import User
+
+from .models import Authority
+
+
+BOOKS_CLAIM = 'books'
+EPOCH_CLAIM = 'epoch'
+GRANTS_CLAIM = 'grants'
+
+
+def state_key(user):
+    return f'accounts:token-state:{user}'
+
+
+def token_state(user):
+    """
+    ``(epoch, grants)`` of a user, or ``None`` when the user cannot log in.
+
+    The revocation epoch and the number of memberships gained are cached
+    for ``TOKEN_EPOCH_CACHE_TIMEOUT`` seconds, so most requests check them
+    without touching the database.
+    """
+    key = state_key(user)
+    state = cache.get(key)
+
+    if state is None:
+        # replica 可能還沒同步到剛撤銷的 epoch，一定從主資料庫讀
+        row = User.objects\
+            .db_manager(DEFAULT_DB_ALIAS)\
+            .filter(pk=user)\
+            .values_list('token_epoch', 'token_grants', 'is_active')\
+            .first()
+        state = row[:2] if row and row[2] else ()
+        cache.set(key, state, getattr(settings, 'TOKEN_EPOCH_CACHE_TIMEOUT', 60))
+
+    return tuple(state) or None
+
+
+def current_epoch(user):
+    """Revocation epoch of a user, or ``None`` when the user cannot log in."""
+    state = token_state(user)
+
+    return state and state[0]
+
+
+def forget_state(user):
+    # 提交前可能又被讀進快取，提交後再清一次
+    cache.delete(state_key(user))
+    transaction.on_commit(lambda: cache.delete(state_key(user)))
+
+
+def bump_epoch(user):
+    """Reject the tokens issued to the user so far."""
+    User.objects.filter(pk=user).update(token_epoch=F('token_epoch') + 1)
+    forget_state(user)
+
+
+def bump_grants(user):
+    """Look the roles of the tokens issued so far up in the database."""
+    User.objects.filter(pk=user).update(token_grants=F('token_grants') + 1)
+    forget_state(user)
+
+
+def add_claims(token, user):
+    """Embed the user's role in every book, the current epoch and grants."""
+    token[BOOKS_CLAIM] = {
+        str(book): authority for book, authority in Authority.objects
+        .filter(user=user)
+        .exclude(authority=Authority.LEAVE)
+        .values_list('book', 'authority')
+    }
+    token[EPOCH_CLAIM], token[GRANTS_CLAIM] = token_state(user) or (None, None)
+
+    return token
+
+
+class BookTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user.pk)
+
+
+class BookTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        """Issue tokens with the roles and epoch of now, not of the login."""
+        refresh = RefreshToken(attrs['refresh'])
+        user = refresh[api_settings.USER_ID_CLAIM]
+
+        if current_epoch(user) is None:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        add_claims(refresh, user)
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            data['refresh'] = str(refresh)
+
+        return data
+
+
+class BookTokenUser(TokenUser):
+    """
+    Stateless user that knows its books and roles from the token.
+
+    The ``User`` row is only loaded when a view needs it as ``instance``.
+    Once the user gained a membership or role the token does not list,
+    ``books`` is ``None`` and the roles are read from the database.
+    """
+    roles_outdated = False
+
+    @cached_property
+    def books(self):
+        if self.roles_outdated:
+            return None
+
+        return {
+            int(book): authority
+            for book, authority in self.token.get(BOOKS_CLAIM, {}).items()
+        }
+
+    @cached_property
+    def instance(self):
+        return User.objects.get(pk=self.pk)
+
+    def __eq__(self, other):
+        return self.pk == getattr(other, 'pk', None)
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+class BookJWTAuthentication(JWTAuthentication):
+    """
+    Authenticate from the token alone, checking only the revocation epoch.
+
+    Losing a membership or role bumps the epoch, so tokens still granting it
+    are rejected and clients refresh them. Gaining one only bumps the grants,
+    the token keeps working with its roles read from the database.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token or \
+                BOOKS_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = BookTokenUser(validated_token)
+        state = token_state(user.pk)
+
+        if state is None:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        epoch, grants = state
+
+        if validated_token.get(EPOCH_CLAIM) != epoch:
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+
+        user.roles_outdated = validated_token.get(GRANTS_CLAIM) != grants
+
+        return user
@@ -0,0 +1,191 @@
+import datetime
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import UploadSession
+
+
+CHUNK_SIZE = 64 * 1024
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    pass
+
+
+class UploadBusy(UploadError):
+    pass
+
+
+def parse_content_range(header, size):
+    """``(start, length)`` of a ``Content-Range: bytes start-end/size`` header."""
+    match = CONTENT_RANGE.match(header or '')
+
+    if match is None:
+        raise UploadError('Content-Range must be "bytes <start>-<end>/<size>".')
+
+    start, end, total = map(int, match.groups())
+
+    if total != size or start > end or end >= size:
+        raise UploadError('Content-Range does not fit the upload.')
+
+    return start, end - start + 1
+
+
+def reserve(session, start):
+    """Let only the calling request write the range starting at ``start``."""
+    lease = datetime.timedelta(seconds=settings.UPLOAD_SESSION_LEASE)
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+
+        if session.finished:
+            raise UploadError('The upload is already finished.')
+        if start != session.received:
+            raise OffsetMismatch(f'Expected the range to start at {session.received}.')
+        if session.writer is not None and session.update_at > timezone.now() - lease:
+            raise UploadBusy('Another request is writing to the upload.')
+
+        session.writer = uuid.uuid4()
+        session.save()
+
+    return session
+
+
+def release(session, writer, received):
+    """Record what the reserving request wrote and end its reservation."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+
+        # 寫太久被其他請求接手，這次寫入的資料不算數
+        if session.writer != writer:
+            raise UploadBusy('Another request took over the upload.')
+
+        session.received = received
+        session.writer = None
+        session.save()
+
+    return session
+
+
+def write_chunk(session, stream, start, length):
+    """
+    Append a byte range read from ``stream`` to the partial file.
+
+    Only the next missing range is accepted, and whatever arrived before a
+    dropped connection is kept, so clients resume from ``received``. The
+    body is copied in ``CHUNK_SIZE`` pieces and never held in memory.
+
+    The session is only locked to reserve and to record the range, so slow
+    clients hold neither a transaction nor the row while the body arrives.
+    """
+    session = reserve(session, start)
+    received = start
+
+    try:
+        os.makedirs(os.path.dirname(session.path), exist_ok=True)
+        descriptor = os.open(session.path, os.O_WRONLY | os.O_CREAT, 0o600)
+
+        with os.fdopen(descriptor, 'wb') as file:
+            # 先前中斷的請求可能寫了沒記錄到的資料，從已接收處覆寫
+            file.seek(start)
+            file.truncate()
+
+            while received < start + length:
+                chunk = stream.read(min(CHUNK_SIZE, start + length - received))
+
+                if not chunk:
+                    break
+
+                file.write(chunk)
+                received += len(chunk)
+    finally:
+        session = release(session, session.writer, received)
+
+    return session
+
+
+def attach(session, consume):
+    """Move a complete upload into ``consume.image`` and drop the partial file."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+
+        if session.finished:
+            raise UploadError('The upload is already finished.')
+        if session.received != session.size:
+            raise UploadError(f'Received {session.received} of {session.size} bytes.')
+
+        try:
+            with Image.open(session.path) as image:
+                image.verify()
+        except (OSError, Image.DecompressionBombError):
+            raise UploadError('Upload a valid image.')
+
+        with open(session.path, 'rb') as file:
+            # 指定新的 File 才會被當成新上傳，交給圖片處理流程
+            consume.image = File(file, name=session.filename)
+            consume.save()
+
+        session.consume = consume
+        session.save()
+
+    discard(session)
+
+    return consume
+
+
+def discard_path(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard(session):
+    discard_path(session.path)
+
+
+def expire(now=None):
+    """
+    Delete the sessions not updated for ``UPLOAD_SESSION_EXPIRY`` seconds.
+
+    Partial files without a session, left by deleted users, go as well.
+    Returns the number of sessions deleted.
+    """
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY)
+    count = 0
+
+    for session in UploadSession.objects.filter(update_at__lt=cutoff).iterator():
+        # 期間又收到資料的不刪
+        if UploadSession.objects.filter(pk=session.pk, update_at__lt=cutoff).delete()[0]:
+            discard(session)
+            count += 1
+
+    try:
+        names = os.listdir(settings.UPLOAD_SESSION_DIR)
+    except FileNotFoundError:
+        names = []
+
+    # 檔案都在 session 提交後才建立，先列檔案再查 session 就不會誤刪
+    sessions = {
+        str(pk) for pk in UploadSession.objects.values_list('pk', flat=True).iterator()}
+
+    for name in names:
+        stem, ext = os.path.splitext(name)
+
+        if ext == '.part' and stem not in sessions:
+            discard_path(os.path.join(settings.UPLOAD_SESSION_DIR, name))
+
+    return count
@@ -0,0 +1,84 @@
+import hashlib
+
+from django.utils.http import parse_etags
+
+from .models import AccountBook, Authority
+
+
+def book_versions(user, book=None):
+    """``(book, sequence, authority)`` of the books visible to the user, in one query."""
+    claims = getattr(user, 'books', None)
+
+    if claims is not None:
+        books = AccountBook.objects.filter(pk__in=list(claims))
+
+        if book is not None:
+            books = books.filter(pk=book)
+
+        return [
+            (pk, sequence, claims[pk])
+            for pk, sequence in books.order_by('pk').values_list('pk', 'sequence')
+        ]
+
+    authorities = Authority.objects\
+        .filter(user=user.pk)\
+        .exclude(authority=Authority.LEAVE)
+
+    if book is not None:
+        authorities = authorities.filter(book=book)
+
+    return list(authorities
+                .order_by('book')
+                .values_list('book', 'book__sequence', 'authority'))
+
+
+def signature(request, versions, *parts):
+    """
+    Digest of everything a read response depends on.
+
+    Any write to a book or its children bumps the book's sequence, and
+    joining or leaving a book changes which books are listed, so the digest
+    only changes when the response might.
+    """
+    digest = hashlib.sha1()
+
+    for part in (
+        request.build_absolute_uri(),
+        request.META.get('HTTP_ACCEPT', ''),
+        versions,
+        *parts,
+    ):
+        digest.update(repr(part).encode())
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def member_profiles(book):
+    """Profile columns of the members of a book, which change without its sequence."""
+    return list(Authority.objects
+                .filter(book=book)
+                .exclude(authority=Authority.LEAVE)
+                .order_by('user')
+                .values_list(
+                    'user',
+                    'user__email',
+                    'user__first_name',
+                    'user__last_name',
+                    'user__profile',
+                ))
+
+
+def etag(request, versions, *parts):
+    return f'W/"{signature(request, versions, request.user.pk, *parts)}"'
+
+
+def none_match(request, etag):
+    """Whether ``If-None-Match`` still holds, compared weakly."""
+    tags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    weak = etag[2:] if etag.startswith('W/') else etag
+
+    return not any(
+        tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == weak
+        for tag in tags
+    )
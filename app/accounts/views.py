@@ -1,61 +1,240 @@
+import datetime
+
+from django.conf import settings
 from django.shortcuts import render
-from django.http import Http404
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 
 from .models import (
     AccountBook,
     Authority,
+    BookBalance,
     Category,
+    Change,
     Consume,
+    MonthlyCategorySpending,
+    MonthlyPayerSpending,
     Proportion,
+    UploadSession,
+)
+from . import cache, exports, rows, search, sync, uploads, versions
+from .bulk import create_consumes
+from .jobs import expire_upload_session
+from .imports import ImportConflict, MalformedFile, file_key, import_consumes, text_rows
+from .pagination import ConsumePagination, ProportionPagination
+from .permissions import (
+    IsBookWriter,
+    IsBookWriterOrReadOnly,
+    IsCurrentUser,
+    WRITERS,
+    book_of,
+    role_of,
 )
-from .permissions import IsCurrentUser
+from .settlement import net_positions, simplify
 from .serializers import (
     AccountBookSerializer,
     AuthoritySerializer,
+    BookBalanceSerializer,
+    BookSnapshotSerializer,
+    BulkConsumeSerializer,
     ModifyAuthoritySerializer,
     CategorySerializer,
+    CategorySpendingSerializer,
     ConsumeSerializer,
+    FinalizeUploadSerializer,
+    NestedConsumeSerializer,
+    PayerSpendingSerializer,
     ProportionSerializer,
+    TransferSerializer,
+    UploadSessionSerializer,
 )
 from rest_framework.generics import get_object_or_404
+from rest_framework.utils.urls import replace_query_param
+
+from app.jobs.queue import enqueue
+from core.sparse import SparseFieldsMixin
+from core.timing import TimingMixin, span
+
+
+SNAPSHOT_PREFETCHES = {
+    'categories': Prefetch('category', Category.objects.order_by('pk')),
+    'members': Prefetch(
+        'book',
+        Authority.objects
+        .exclude(authority=Authority.LEAVE)
+        .select_related('user')
+        .order_by('pk'),
+        to_attr='members',
+    ),
+    'consumes': Prefetch(
+        'consume',
+        Consume.objects
+        .order_by('-consume_at', '-id')
+        .prefetch_related(Prefetch('list', Proportion.objects.order_by('pk'))),
+    ),
+}
+
+
+class VisibleToUserMixin:
+    def get_queryset(self):
+        return super().get_queryset().visible_to(self.request.user)
+
+
+class BookWriterMixin:
+    """
+    Only let creators and writers add rows to a book or move rows into it.
+
+    Changes to existing rows are checked by ``IsBookWriterOrReadOnly``.
+    """
+
+    def check_book_writer(self, serializer):
+        related = serializer.validated_data.get('consume') or \
+            serializer.validated_data.get('book')
+
+        if related is not None and \
+                role_of(self.request.user, book_of(related)) not in WRITERS:
+            raise PermissionDenied('Cannot post.')
+
+    def perform_create(self, serializer):
+        self.check_book_writer(serializer)
+        super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        self.check_book_writer(serializer)
+        super().perform_update(serializer)
+
+
+class RowListMixin:
+    """
+    List rows read with ``.values()`` instead of model instances.
+
+    The rows are rendered by converters compiled from the serializer, which
+    produce the same JSON at a fraction of the cost per row. Serializers
+    with fields the converters do not support are used as they are.
+    """
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = rows.build(self.get_serializer())
+
+        if row_serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        columns = list(row_serializer.columns)
+        ordering = getattr(self.paginator, 'ordering', ())
+        columns += [field.lstrip('-') for field in ordering if field.lstrip('-') not in columns]
+
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(queryset)
+
+        with span(request, 'serialize'):
+            data = row_serializer.to_representation(queryset if page is None else page)
+
+        if page is not None:
+            return self.get_paginated_response(data)
+
+        return Response(data)
+
+
+class ConditionalGetMixin:
+    """
+    Tag list and detail responses with the versions of the visible books.
+
+    A matching ``If-None-Match`` is answered with 304 after a single query on
+    the books, without reading or serializing the child tables.
+    """
+    version_book_param = 'book'
+    cache_responses = False
+
+    def get_version_book(self):
+        return self.request.query_params.get(self.version_book_param)
 
+    def conditional(self, view, request, *args, parts=(), **kwargs):
+        """Answer with ``view`` unless the versions and extra ``parts`` still match."""
+        book = str(self.get_version_book() or '')
 
-class AccountBookViewSet(viewsets.ModelViewSet):
+        # 先取版本再查資料，期間若有寫入，下次比對時也只會多回一次 200
+        book_versions = versions.book_versions(
+            request.user, int(book) if book.isdigit() else None)
+        etag = versions.etag(request, book_versions, *parts)
+
+        if not versions.none_match(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        elif self.cache_responses:
+            response = self.cached(book_versions, view, request, *args, parts=parts, **kwargs)
+        else:
+            response = view(request, *args, **kwargs)
+
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Accept', 'Authorization'])
+
+        return response
+
+    def cached(self, book_versions, view, request, *args, parts=(), **kwargs):
+        """
+        Serve the serialized payload from the response cache.
+
+        Entries are keyed by the versions and roles of the books, so a write
+        to a book moves its readers to a new key instead of invalidating the
+        old one, and members with the same role share entries.
+        """
+        backend = cache.get_backend()
+        key = 'accounts:{}:{}:{}'.format(
+            self.basename,
+            self.action,
+            versions.signature(request, book_versions, *parts),
+        )
+        data = backend.get(key)
+
+        if data is not None:
+            return Response(data)
+
+        response = view(request, *args, **kwargs)
+
+        if response.status_code == status.HTTP_200_OK:
+            backend.set(key, response.data)
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class AccountBookViewSet(TimingMixin, ConditionalGetMixin, RowListMixin, SparseFieldsMixin, VisibleToUserMixin, viewsets.ModelViewSet):
     queryset = AccountBook.objects.all()
     serializer_class = AccountBookSerializer
     permission_classes = [IsAuthenticated]
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-
-        return queryset.filter(
-            id__in=[Authority.book.id for Authority in Authority.objects
-                    .filter(user=self.request.user)
-                    .exclude(authority=Authority.LEAVE)]
-        )
+    def get_version_book(self):
+        return self.kwargs.get('pk')
 
     def perform_create(self, serializer):
         account_book = serializer.save()
 
         authority = Authority.objects.create(
-            user=self.request.user,
+            user_id=self.request.user.pk,
             book=account_book,
         )
 
         authority.save()
 
     def perform_destroy(self, instance):
-        authority = Authority.objects.filter(
-            user=self.request.user).filter(book=instance).first().authority
+        authority = role_of(self.request.user, instance.pk)
 
-        if authority is Authority.CREATOR:
+        if authority == Authority.CREATOR:
             super().perform_destroy(instance)
             return
 
@@ -70,7 +249,7 @@ class AccountBookViewSet(viewsets.ModelViewSet):
     def leave(self, request, book):
         account_book = get_object_or_404(AccountBook, pk=book)
         authority = get_object_or_404(Authority,
-                                      user=self.request.user,
+                                      user=self.request.user.pk,
                                       book=account_book)
 
         authority.authority = Authority.LEAVE
@@ -80,23 +259,192 @@ class AccountBookViewSet(viewsets.ModelViewSet):
             'success': True,
         })
 
+    @action(['GET'], True, permission_classes=[IsAuthenticated])
+    def balances(self, request, pk=None):
+        account_book = self.get_object()
+        serializer = BookBalanceSerializer(
+            BookBalance.objects.filter(book=account_book).order_by('user'),
+            many=True,
+        )
+
+        return Response(serializer.data)
+
+    @action(['GET'], True, permission_classes=[IsAuthenticated])
+    def settlement(self, request, pk=None):
+        account_book = self.get_object()
+        serializer = TransferSerializer(
+            simplify(net_positions(account_book)), many=True)
+
+        return Response(serializer.data)
+
+    @action(['POST'], True, permission_classes=[IsAuthenticated, IsBookWriter])
+    def settle(self, request, pk=None):
+        account_book = self.get_object()
+
+        with transaction.atomic():
+            # 鎖住帳本，避免同時結清產生重複的還款
+            AccountBook.objects.select_for_update().get(pk=account_book.pk)
+            transfers = simplify(net_positions(account_book))
+            consumes = create_consumes(
+                [
+                    Consume(
+                        name='還款',
+                        creator_id=transfer['payer'],
+                        book=account_book,
+                        is_repay=True,
+                    ) for transfer in transfers
+                ],
+                [
+                    [Proportion(username_id=transfer['payee'], fee=transfer['amount'])]
+                    for transfer in transfers
+                ],
+            )
+
+        serializer = ConsumeSerializer(
+            consumes, many=True, context=self.get_serializer_context())
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(['GET'], True, permission_classes=[IsAuthenticated])
+    def export(self, request, pk=None):
+        account_book = self.get_object()
+        kind = request.query_params.get('type', 'csv')
+
+        if kind not in exports.FORMATS:
+            raise Http404
+
+        export, content_type = exports.FORMATS[kind]
+        response = StreamingHttpResponse(
+            export(account_book), content_type=content_type)
+        response['Content-Disposition'] = \
+            f'attachment; filename="book-{account_book.pk}.{kind}"'
+
+        return response
+
+    @action(['POST'], True, 'import', permission_classes=[IsAuthenticated, IsBookWriter])
+    def import_file(self, request, pk=None):
+        account_book = self.get_object()
+
+        upload = request.FILES.get('file')
+
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+
+        key = request.data.get('key') or file_key(upload)
+
+        if len(key) > 64:
+            raise ValidationError({'key': ['Ensure this field has no more than 64 characters.']})
+
+        try:
+            report = import_consumes(account_book, text_rows(upload.file), key)
+        except ImportConflict as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        except MalformedFile as e:
+            raise ValidationError({'file': [str(e)]})
+
+        return Response(report)
+
+    @action(['GET'], True, permission_classes=[IsAuthenticated])
+    def reports(self, request, pk=None):
+        account_book = self.get_object()
+        months = {}
+
+        for param, lookup in [('since', 'month__gte'), ('until', 'month__lte')]:
+            if param not in request.query_params:
+                continue
+
+            try:
+                months[lookup] = datetime.datetime.strptime(
+                    request.query_params[param], '%Y-%m').date()
+            except ValueError:
+                raise ValidationError({param: ['Month has wrong format. Use YYYY-MM.']})
+
+        categories = MonthlyCategorySpending.objects\
+            .filter(book=account_book, **months)\
+            .exclude(amount=0)\
+            .select_related('category')\
+            .order_by('month', 'category')
+        payers = MonthlyPayerSpending.objects\
+            .filter(book=account_book, **months)\
+            .exclude(amount=0)\
+            .order_by('month', 'user')
+
+        return Response({
+            'categories': CategorySpendingSerializer(categories, many=True).data,
+            'payers': PayerSpendingSerializer(payers, many=True).data,
+        })
+
+    @action(['GET'], True, permission_classes=[IsAuthenticated])
+    def changes(self, request, pk=None):
+        account_book = self.get_object()
+
+        params = {}
 
-class AuthorityViewSet(viewsets.ModelViewSet):
+        for param, default in [('since', 0), ('limit', 500)]:
+            try:
+                params[param] = max(int(request.query_params.get(param, default)), 0)
+            except ValueError:
+                raise ValidationError({param: ['A valid integer is required.']})
+
+        since, limit = params['since'], min(max(params['limit'], 1), 1000)
+
+        changes = list(Change.objects
+                       .filter(book=account_book, sequence__gt=since)
+                       .order_by('sequence')[:limit + 1])
+        sequence = changes[min(len(changes), limit) - 1].sequence if changes else since
+        next_url = None
+
+        if len(changes) > limit:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'since', sequence)
+
+        return Response({
+            'sequence': sequence,
+            'next': next_url,
+            'results': sync.deltas(
+                account_book, changes[:limit], self.get_serializer_context()),
+        })
+
+    @action(['GET'], True, permission_classes=[IsAuthenticated])
+    def snapshot(self, request, pk=None):
+        """
+        The book with its categories, members and consumes in one document.
+
+        Every relation is prefetched with one query, so the number of
+        queries does not depend on the size of the book.
+        """
+        expand = request.query_params.get('expand')
+        expand = BookSnapshotSerializer.EXPANSIONS if expand is None else \
+            [name for name in expand.split(',') if name]
+        unknown = set(expand) - set(BookSnapshotSerializer.EXPANSIONS)
+
+        if unknown:
+            raise ValidationError({'expand': [
+                f'Unknown expansions: {", ".join(sorted(unknown))}.']})
+
+        def snapshot(request, *args, **kwargs):
+            account_book = self.get_object()
+            prefetch_related_objects(
+                [account_book], *[SNAPSHOT_PREFETCHES[name] for name in expand])
+
+            return Response(BookSnapshotSerializer(
+                account_book, expand=expand, context=self.get_serializer_context()).data)
+
+        # 成員的使用者資料改了不會動到帳本的版本，另外算進 ETag
+        parts = [versions.member_profiles(pk)] \
+            if 'members' in expand and str(pk).isdigit() else []
+
+        return self.conditional(snapshot, request, pk=pk, parts=parts)
+
+
+class AuthorityViewSet(TimingMixin, ConditionalGetMixin, RowListMixin, SparseFieldsMixin, VisibleToUserMixin, viewsets.ModelViewSet):
     queryset = Authority.objects.all()
     serializer_class = AuthoritySerializer
     permission_classes = [IsAuthenticated]
+    cache_responses = True
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['book']
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-
-        return queryset.filter(
-            book__in=[Authority.book.id for Authority in Authority.objects
-                      .filter(user=self.request.user)
-                      .exclude(authority=Authority.LEAVE)]
-        )
-
     def get_serializer_class(self):
         if self.action in SAFE_METHODS:
             return super().get_serializer_class()
@@ -109,25 +457,24 @@ class AuthorityViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         book = get_object_or_404(AccountBook,
                                  pk=serializer.validated_data['book'].id)
-        authorities = Authority.objects\
-            .filter(user=self.request.user)\
-            .filter(book=book)
+        role = role_of(self.request.user, book.pk)
 
-        if not authorities or authorities.first().authority in [Authority.CREATOR, Authority.WRITER]:
+        # 不在帳本裡時，只有從未加入過（不是已離開）才能新增
+        if role in WRITERS or role is None and not Authority.objects\
+                .filter(user=self.request.user.pk)\
+                .filter(book=book).exists():
             super().perform_create(serializer)
             return
 
         raise PermissionDenied('Cannot post.')
 
     def perform_destroy(self, instance):
-        me = Authority.objects\
-            .filter(user=self.request.user)\
-            .filter(book=instance.book).first()
+        me = role_of(self.request.user, instance.book_id)
 
         authority = Authority.objects.get(pk=instance.id)
 
-        if instance.user != self.request.user and \
-            me.authority <= instance.authority and \
+        if instance.user_id != self.request.user.pk and \
+            me is not None and me <= instance.authority and \
             (Authority.objects.filter(book=authority.book).count() > 1 or
              instance.authority is not Authority.CREATOR):
             authority.authority = Authority.LEAVE
@@ -137,40 +484,30 @@ class AuthorityViewSet(viewsets.ModelViewSet):
         raise PermissionDenied('Cannot delete.')
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(BookWriterMixin, TimingMixin, ConditionalGetMixin, RowListMixin, SparseFieldsMixin, VisibleToUserMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsBookWriterOrReadOnly]
+    cache_responses = True
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['book']
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-
-        return queryset.filter(
-            book__in=[Authority.book.id for Authority in Authority.objects
-                      .filter(user=self.request.user)
-                      .exclude(authority=Authority.LEAVE)]
-        )
-
 
-class ConsumeViewSet(viewsets.ModelViewSet):
+class ConsumeViewSet(BookWriterMixin, TimingMixin, ConditionalGetMixin, RowListMixin, SparseFieldsMixin, VisibleToUserMixin, viewsets.ModelViewSet):
     queryset = Consume.objects.all()
     serializer_class = ConsumeSerializer
-    permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['book', 'is_repay']
-
-    def get_queryset(self):
-        queryset = super().get_queryset()
-
-        return queryset.filter(
-            book__in=[Authority.book.id for Authority in Authority.objects
-                      .filter(user=self.request.user)
-                      .exclude(authority=Authority.LEAVE)]
-        )
+    permission_classes = [IsAuthenticated, IsBookWriterOrReadOnly]
+    cache_responses = True
+    pagination_class = ConsumePagination
+    filter_backends = [DjangoFilterBackend, search.SearchFilter]
+    filterset_fields = {
+        'book': ['exact'],
+        'is_repay': ['exact'],
+        'consume_at': ['gte', 'lte'],
+    }
 
     def perform_create(self, serializer):
+        self.check_book_writer(serializer)
         consume = serializer.save()
 
         # proportion = Proportion.objects.create(
@@ -181,10 +518,102 @@ class ConsumeViewSet(viewsets.ModelViewSet):
 
         # proportion.save()
 
+    @action(['POST'], False, permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        serializer = BulkConsumeSerializer(
+            data=request.data,
+            many=True,
+            context=self.get_serializer_context(),
+        )
+
+        with transaction.atomic():
+            serializer.is_valid(raise_exception=True)
+            consumes = serializer.save()
+
+        serializer = NestedConsumeSerializer(
+            Consume.objects
+            .filter(pk__in=[consume.pk for consume in consumes])
+            .prefetch_related('list')
+            .order_by('pk'),
+            many=True,
+            context=self.get_serializer_context(),
+        )
 
-class ProportionViewSet(viewsets.ModelViewSet):
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ProportionViewSet(BookWriterMixin, TimingMixin, ConditionalGetMixin, RowListMixin, SparseFieldsMixin, VisibleToUserMixin, viewsets.ModelViewSet):
     queryset = Proportion.objects.all()
     serializer_class = ProportionSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsBookWriterOrReadOnly]
+    pagination_class = ProportionPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['consume']
+
+
+class UploadSessionViewSet(TimingMixin, SparseFieldsMixin, mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable receipt uploads.
+
+    Create a session with the file name and size, ``PUT`` byte ranges with a
+    ``Content-Range`` header, then ``finalize`` it onto a consume. After a
+    dropped connection, ``GET`` the session and continue from ``received``.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated, IsCurrentUser]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user.pk)
+
+    def perform_create(self, serializer):
+        session = serializer.save(user_id=self.request.user.pk)
+        enqueue(expire_upload_session, str(session.pk),
+                delay=settings.UPLOAD_SESSION_EXPIRY)
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+        instance.delete()
+
+    def update(self, request, pk=None):
+        session = self.get_object()
+
+        try:
+            start, length = uploads.parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE'), session.size)
+            session = uploads.write_chunk(session, request.stream, start, length)
+        except (uploads.OffsetMismatch, uploads.UploadBusy) as e:
+            session.refresh_from_db()
+
+            return Response(
+                {'detail': str(e), 'received': session.received},
+                status=status.HTTP_409_CONFLICT,
+            )
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': [str(e)]})
+
+        return Response(self.get_serializer(session).data)
+
+    @action(['POST'], True, permission_classes=[IsAuthenticated, IsCurrentUser])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        serializer = FinalizeUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        consume = get_object_or_404(
+            Consume.objects.visible_to(request.user),
+            pk=serializer.validated_data['consume'],
+        )
+        if role_of(request.user, consume.book_id) not in WRITERS:
+            raise PermissionDenied('Cannot attach.')
+
+        try:
+            consume = uploads.attach(session, consume)
+        except uploads.UploadError as e:
+            raise ValidationError({'detail': [str(e)]})
+
+        return Response(ConsumeSerializer(
+            consume, context=self.get_serializer_context()).data)
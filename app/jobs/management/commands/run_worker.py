@@ -0,0 +1,72 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app.jobs.queue import serve
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=4, help='Worker threads per process.')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Worker processes, forked from this one when more than 1.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1,
+            help='Seconds to wait when the queue is empty.')
+        parser.add_argument(
+            '--visibility-timeout', type=int,
+            help='Seconds before a job that is still running is handed out again.')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker_options = {
+            'poll_interval': options['poll_interval'],
+            'visibility_timeout': options['visibility_timeout'],
+            'burst': options['burst'],
+        }
+
+        if options['processes'] > 1:
+            context = multiprocessing.get_context('fork')
+            stopping = context.Event()
+            processes = [
+                context.Process(
+                    target=serve,
+                    args=(stopping, options['threads']),
+                    kwargs=worker_options,
+                ) for _ in range(options['processes'])
+            ]
+        else:
+            stopping = threading.Event()
+            processes = []
+
+        def stop(signum, frame):
+            # 做完手上的工作再結束
+            stopping.set()
+
+        handlers = {
+            signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        try:
+            if processes:
+                # 子行程不能共用父行程的資料庫連線
+                connections.close_all()
+
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+            else:
+                serve(stopping, options['threads'], **worker_options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:35
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='函式')),
+                ('payload', models.TextField(default='{}', verbose_name='參數')),
+                ('status', models.PositiveIntegerField(choices=[(0, 'queued'), (1, 'running'), (2, 'failed')], default=0)),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='執行次數')),
+                ('max_attempts', models.PositiveIntegerField(default=5, verbose_name='最多執行次數')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='可執行時間')),
+                ('lease', models.UUIDField(default=uuid.uuid4, verbose_name='租約')),
+                ('last_error', models.TextField(blank=True, verbose_name='最後錯誤')),
+                ('create_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('update_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_at'], name='jobs_job_status_f5c023_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+import json
+import uuid
+
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A function call to run outside the request.
+
+    A job is visible to workers once ``run_at`` has passed. Claiming it
+    moves ``run_at`` forward by the visibility timeout, so the job shows up
+    again if the worker dies before finishing it, and replaces ``lease`` so
+    only the latest claim can finish it.
+    """
+    QUEUED, RUNNING, FAILED = range(3)
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (FAILED, 'failed'),
+    )
+
+    name = models.CharField('函式', max_length=255)
+    payload = models.TextField('參數', default='{}')
+    status = models.PositiveIntegerField(choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField('執行次數', default=0)
+    max_attempts = models.PositiveIntegerField('最多執行次數', default=5)
+    run_at = models.DateTimeField('可執行時間', default=timezone.now)
+    lease = models.UUIDField('租約', default=uuid.uuid4)
+    last_error = models.TextField('最後錯誤', blank=True)
+    create_at = models.DateTimeField('建立時間', auto_now_add=True)
+    update_at = models.DateTimeField('更新時間', auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    @property
+    def arguments(self):
+        payload = json.loads(self.payload)
+        return payload.get('args', []), payload.get('kwargs', {})
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()}, {self.attempts} attempts)'
@@ -0,0 +1,161 @@
+import datetime
+import json
+import logging
+import random
+import threading
+import traceback
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'VISIBILITY_TIMEOUT': 300,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 10,
+    'MAX_BACKOFF': 3600,
+}
+# 每次取出的候選數，被其他 worker 搶走時改試下一個
+CANDIDATES = 10
+
+
+def get_setting(name):
+    return getattr(settings, 'JOBS', {}).get(name, DEFAULTS[name])
+
+
+def job_name(func):
+    return func if isinstance(func, str) else f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, delay=0, max_attempts=None, **kwargs):
+    """
+    Queue ``func(*args, **kwargs)`` for a worker.
+
+    The job is written in the current transaction, so it runs only once the
+    transaction commits and is dropped if it rolls back. Arguments must be
+    JSON serializable. A job can run more than once when a worker dies, so
+    it has to be idempotent.
+    """
+    return Job.objects.create(
+        name=job_name(func),
+        payload=json.dumps({'args': args, 'kwargs': kwargs}, cls=DjangoJSONEncoder),
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+        max_attempts=max_attempts or get_setting('MAX_ATTEMPTS'),
+    )
+
+
+def backoff(attempts):
+    """Seconds before a retry, doubling per attempt with random jitter."""
+    delay = min(get_setting('BACKOFF') * 2 ** (attempts - 1), get_setting('MAX_BACKOFF'))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def claim(visibility_timeout=None):
+    """
+    Take the next visible job, or return ``None`` when there is none.
+
+    A job is taken by replacing its lease with an ``UPDATE`` that only
+    matches the lease read before, so of several workers racing for it
+    exactly one succeeds, without row locks the database may not have.
+    """
+    now = timezone.now()
+    timeout = datetime.timedelta(
+        seconds=visibility_timeout or get_setting('VISIBILITY_TIMEOUT'))
+    candidates = Job.objects\
+        .filter(status__in=[Job.QUEUED, Job.RUNNING], run_at__lte=now)\
+        .order_by('run_at', 'pk')\
+        .values_list('pk', 'lease', 'status', 'attempts', 'max_attempts')[:CANDIDATES]
+
+    for pk, lease, status, attempts, max_attempts in candidates:
+        jobs = Job.objects.filter(pk=pk, lease=lease)
+
+        # 執行中卻過了期限，表示 worker 在執行時死掉
+        if status == Job.RUNNING and attempts >= max_attempts:
+            jobs.update(
+                status=Job.FAILED, last_error='Visibility timeout expired.', update_at=now)
+            continue
+
+        if jobs.update(
+                status=Job.RUNNING,
+                lease=uuid.uuid4(),
+                attempts=F('attempts') + 1,
+                run_at=now + timeout,
+                update_at=now):
+            return Job.objects.get(pk=pk)
+
+    return None
+
+
+def run(job):
+    """Call the function of a claimed job and record the outcome."""
+    jobs = Job.objects.filter(pk=job.pk, lease=job.lease)
+
+    try:
+        args, kwargs = job.arguments
+        import_string(job.name)(*args, **kwargs)
+    except Exception:
+        logger.exception('Job %s failed', job)
+        now = timezone.now()
+
+        if job.attempts >= job.max_attempts:
+            jobs.update(status=Job.FAILED, last_error=traceback.format_exc(), update_at=now)
+        else:
+            jobs.update(
+                status=Job.QUEUED,
+                run_at=now + datetime.timedelta(seconds=backoff(job.attempts)),
+                last_error=traceback.format_exc(),
+                update_at=now)
+
+        return False
+
+    # 成功的工作直接刪除，資料表只留下待辦與失敗的
+    jobs.delete()
+    return True
+
+
+def work(stopping, poll_interval=1, visibility_timeout=None, burst=False):
+    """
+    Run jobs until ``stopping`` is set.
+
+    With ``burst`` the loop also ends once no job is visible, which suits
+    cron and tests.
+    """
+    try:
+        while not stopping.is_set():
+            close_old_connections()
+            job = claim(visibility_timeout)
+
+            if job is not None:
+                run(job)
+            elif burst:
+                break
+            else:
+                stopping.wait(poll_interval)
+    finally:
+        connections.close_all()
+
+
+def serve(stopping, threads=1, **options):
+    """Run ``work`` in a pool of threads of this process."""
+    pool = [
+        threading.Thread(
+            target=work, args=(stopping,), kwargs=options, name=f'worker-{index}')
+        for index in range(threads)
+    ]
+
+    for thread in pool:
+        thread.start()
+
+    for thread in pool:
+        # 不帶逾時的 join 會擋住主執行緒的訊號處理
+        while thread.is_alive():
+            thread.join(1)
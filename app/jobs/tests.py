@@ -0,0 +1,87 @@
+import datetime
+import io
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from app.users.models import User
+
+from . import queue
+from .models import Job
+
+
+calls = []
+
+
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+def explode():
+    raise ValueError('boom')
+
+
+class WorkerTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_worker_runs_and_removes_jobs(self):
+        queue.enqueue(record, 1, 'two', three=3)
+        queue.enqueue(record, 4, delay=60)
+
+        call_command('run_worker', threads=1, burst=True, stdout=io.StringIO())
+
+        self.assertEqual(calls, [((1, 'two'), {'three': 3})])
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)),
+                         ['{"args": [4], "kwargs": {}}'])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_failed_jobs_back_off_until_out_of_attempts(self):
+        job = queue.enqueue(explode, max_attempts=2)
+
+        with self.assertLogs('app.jobs.queue', 'ERROR'):
+            self.assertFalse(queue.run(queue.claim()))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ValueError: boom', job.last_error)
+        self.assertIsNone(queue.claim())
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('app.jobs.queue', 'ERROR'):
+            self.assertFalse(queue.run(queue.claim()))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_jobs_reappear_after_the_visibility_timeout(self):
+        queue.enqueue(record)
+        first = queue.claim(visibility_timeout=60)
+
+        self.assertIsNone(queue.claim())
+
+        # worker 死掉後過了期限，其他 worker 可以重新取得
+        Job.objects.update(run_at=timezone.now() - datetime.timedelta(seconds=1))
+        second = queue.claim()
+
+        self.assertEqual((second.pk, second.attempts), (first.pk, 2))
+        self.assertNotEqual(second.lease, first.lease)
+
+        # 舊的租約已經失效，完成了也不會刪掉工作
+        queue.run(first)
+        self.assertTrue(Job.objects.filter(pk=first.pk).exists())
+        queue.run(second)
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(len(calls), 2)
+
+    def test_password_email_is_queued(self):
+        user = User.objects.create_user('owner@example.com', 'secret')
+        user.send_password_set_email()
+
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'app.users.jobs.send_password_set_email')
+        self.assertEqual(job.arguments, ([user.pk], {}))
@@ -2,4 +2,12 @@ from django.apps import AppConfig
 
 
 class UsersConfig(AppConfig):
-    name = 'users'
+    name = 'app.users'
+    label = 'users'
+
+    def ready(self):
+        from core import images
+
+        from .models import User
+
+        images.register(User, 'profile')
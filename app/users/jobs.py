@@ -0,0 +1,25 @@
+from django.template import loader
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .models import User
+
+
+def send_password_set_email(user):
+    user = User.objects.filter(pk=user).first()
+
+    # 排隊期間帳號可能已被刪除
+    if user is None:
+        return
+
+    subject = loader.render_to_string('email/set-password-subject.txt')
+    subject = ''.join(subject.splitlines())
+
+    body = loader.render_to_string('email/set-password-content.html', {
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
+        'user': user,
+    })
+
+    user.email_user(subject, body)
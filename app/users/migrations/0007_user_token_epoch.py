@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_auto_20191228_1257'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_epoch',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='憑證版本'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_token_epoch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_grants',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='權限授予次數'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:09
+
+import app.users.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_user_token_grants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='profile',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to=app.users.models.user_image_path),
+        ),
+    ]
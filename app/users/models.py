@@ -3,13 +3,11 @@ import time
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser, UserManager as AuthUerManager
-from django.contrib.auth.tokens import default_token_generator
-from django.template import loader
-from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode
 
 from django.utils.translation import gettext_lazy as _
 
+from app.jobs.queue import enqueue
+
 
 def user_image_path(instance, filename):
     ext = os.path.splitext(filename)[-1]
@@ -49,7 +47,9 @@ class UserManager(AuthUerManager):
 class User(AbstractUser):
     email = models.EmailField('電子郵件', unique=True)
     profile = models.ImageField(
-        blank=True, null=True, upload_to=user_image_path)
+        blank=True, null=True, upload_to=user_image_path, db_index=True)
+    token_epoch = models.PositiveIntegerField('憑證版本', default=0, editable=False)
+    token_grants = models.PositiveIntegerField('權限授予次數', default=0, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -57,16 +57,9 @@ class User(AbstractUser):
     objects = UserManager()
 
     def send_password_set_email(self):
-        subject = loader.render_to_string('email/set-password-subject.txt')
-        subject = ''.join(subject.splitlines())
-
-        body = loader.render_to_string('email/set-password-content.html', {
-            'uid': urlsafe_base64_encode(force_bytes(self.pk)),
-            'token': default_token_generator.make_token(self),
-            'user': self,
-        })
-
-        self.email_user(subject, body)
+        """Mail a link to set the password, from a background worker."""
+        # 寄信可能很慢，不在請求中進行
+        enqueue('app.users.jobs.send_password_set_email', self.pk)
 
     @property
     def username(self):
@@ -3,10 +3,14 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 
+from core import images
+
 from .models import User
 
 
 class UserSerializer(serializers.ModelSerializer):
+    profile_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = User
         fields = (
@@ -14,11 +18,15 @@ class UserSerializer(serializers.ModelSerializer):
             'email',
             'username',
             'profile',
+            'profile_variants',
             'first_name',
             'last_name',
         )
         read_only_fields = ('email',)
 
+    def get_profile_variants(self, instance):
+        return images.variant_urls(instance.profile)
+
 
 # class PasswordSetSerializer(serializers.Serializer):
 #     password = serializers.CharField()
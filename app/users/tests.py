@@ -1,3 +1,17 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from rest_framework.test import APIClient
+
+from .models import User
+
+
+class UserFieldsTests(TestCase):
+    def test_me_returns_the_requested_fields(self):
+        user = User.objects.create_user('owner@example.com', 'secret')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get(reverse('user-me'), {'fields': 'id,email'})
+
+        self.assertEqual(response.data, {'id': user.pk, 'email': 'owner@example.com'})
@@ -6,12 +6,15 @@ from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 
+from core.sparse import SparseFieldsMixin
+from core.timing import TimingMixin
+
 from .models import User
 from .permissions import IsCurrentUser
 from .serializers import UserSerializer
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(TimingMixin, SparseFieldsMixin, ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, IsCurrentUser]
@@ -25,15 +28,18 @@ class UserViewSet(ModelViewSet):
         permission_classes=[IsAuthenticated],
     )
     def me(self, request):
+        # 以 JWT 驗證時 request.user 不是資料庫裡的使用者
+        user = getattr(request.user, 'instance', request.user)
+
         if request.method in ['PUT', 'PATCH']:
             serializer = self.get_serializer(
-                request.user,
+                user,
                 data=request.data,
                 partial=request.method == 'PATCH',
             )
             serializer.is_valid(raise_exception=True)
             self.perform_update(serializer)
         else:
-            serializer = self.get_serializer(request.user)
+            serializer = self.get_serializer(user)
 
         return Response(serializer.data)
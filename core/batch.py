@@ -0,0 +1,200 @@
+import io
+import json
+import re
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.urls import Resolver404, resolve
+
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+# $名稱.欄位 引用同一批前面操作的回應，例如 $book.id
+REFERENCE = re.compile(r'\$(\w+)((?:\.\w+)+)')
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class UnresolvedReference(Exception):
+    pass
+
+
+class Rollback(Exception):
+    pass
+
+
+def lookup(results, match):
+    name, path = match.group(1), match.group(2)[1:].split('.')
+
+    if name not in results:
+        raise UnresolvedReference(match.group())
+
+    value = results[name]
+
+    for key in path:
+        try:
+            value = value[int(key) if isinstance(value, list) else key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise UnresolvedReference(match.group())
+
+    return value
+
+
+def substitute(value, results):
+    """Replace references in ``value`` by the values they point to."""
+    if isinstance(value, dict):
+        return {key: substitute(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    match = REFERENCE.fullmatch(value)
+
+    # 整個字串只有引用時保留原本的型別，id 仍是數字
+    if match:
+        return lookup(results, match)
+
+    return REFERENCE.sub(lambda match: str(lookup(results, match)), value)
+
+
+class BatchView(APIView):
+    """
+    Run several API requests in one round trip.
+
+    The body holds ``operations``, each with a ``method``, a ``path`` and an
+    optional JSON ``body`` and ``id``. Operations run in order as the
+    authenticated user, and strings like ``$book.id`` in a path or body
+    are replaced by the response of the earlier operation named ``book``
+    (or at that index). With ``atomic`` the batch stops at the first failed
+    operation and none of its writes are kept.
+    """
+    permission_classes = [IsAuthenticated]
+    viewsets = ()
+    max_operations = 50
+
+    def post(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        operations = data.get('operations')
+        atomic = bool(data.get('atomic', False))
+
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError({'operations': ['A non-empty list is required.']})
+        if len(operations) > self.max_operations:
+            raise ValidationError({'operations': [
+                f'Ensure this list has no more than {self.max_operations} operations.']})
+
+        try:
+            with transaction.atomic() if atomic else nullcontext():
+                results = self.run(request, operations, atomic)
+        except Rollback as rollback:
+            results = rollback.args[0]
+
+        committed = not atomic or all(result['status'] < 400 for result in results)
+
+        return Response({'committed': committed, 'results': results})
+
+    def run(self, request, operations, atomic):
+        results, bodies = [], {}
+
+        for index, operation in enumerate(operations):
+            result = self.run_operation(request, operation, bodies)
+            results.append(result)
+
+            if atomic and result['status'] >= 400:
+                raise Rollback(results)
+
+            if result['status'] < 400:
+                bodies[str(index)] = result['body']
+                if isinstance(operation, dict) and operation.get('id') is not None:
+                    bodies[str(operation['id'])] = result['body']
+
+        return results
+
+    def run_operation(self, request, operation, bodies):
+        if not isinstance(operation, dict) or \
+                str(operation.get('method', '')).upper() not in METHODS or \
+                not isinstance(operation.get('path'), str):
+            return self.error(
+                operation, status.HTTP_400_BAD_REQUEST,
+                f'Operations need a method out of {", ".join(METHODS)} and a path.')
+
+        try:
+            path = substitute(operation['path'], bodies)
+            body = substitute(operation.get('body'), bodies)
+        except UnresolvedReference as e:
+            return self.error(
+                operation, status.HTTP_424_FAILED_DEPENDENCY, f'Cannot resolve {e}.')
+
+        url = urlsplit(path)
+
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            match = None
+
+        if match is None or getattr(match.func, 'cls', None) not in self.viewsets:
+            return self.error(
+                operation, status.HTTP_404_NOT_FOUND, f'{url.path} cannot be batched.')
+
+        # 每個操作各自一個 savepoint，失敗時只撤銷它自己寫入的資料
+        with transaction.atomic():
+            response = match.func(
+                self.sub_request(request, operation['method'].upper(), url, body),
+                *match.args,
+                **match.kwargs,
+            )
+
+            if response.status_code >= 400:
+                transaction.set_rollback(True)
+
+        return {
+            'id': operation.get('id'),
+            'status': response.status_code,
+            'body': self.response_body(response),
+        }
+
+    def sub_request(self, request, method, url, body):
+        content = b'' if body is None else json.dumps(body, cls=DjangoJSONEncoder).encode()
+        environ = {
+            key: value for key, value in request.META.items()
+            if not key.startswith('HTTP_IF_') and key not in ('CONTENT_TYPE', 'CONTENT_LENGTH')
+        }
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': io.BytesIO(content),
+        })
+
+        sub_request = WSGIRequest(environ)
+        # 沿用這次請求已驗證的使用者，不再解一次憑證。憑證裡的角色是登入時的，
+        # 看不到同一批剛建立的帳本，改用資料庫裡的使用者查詢權限
+        sub_request._force_auth_user = getattr(request.user, 'instance', request.user)
+        sub_request._force_auth_token = request.auth
+
+        return sub_request
+
+    def response_body(self, response):
+        if hasattr(response, 'data'):
+            return response.data
+
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+
+        return content.decode(response.charset)
+
+    def error(self, operation, status_code, detail):
+        return {
+            'id': operation.get('id') if isinstance(operation, dict) else None,
+            'status': status_code,
+            'body': {'detail': detail},
+        }
+
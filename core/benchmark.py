@@ -0,0 +1,151 @@
+import gc
+import math
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app.accounts import cache
+from app.accounts.tokens import add_claims
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of ``values``."""
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def sample_pk(view, book):
+    """Newest object the user can see, taken from ``book`` when possible."""
+    queryset = view.get_queryset()
+    book_path = getattr(queryset, 'book_path', None)
+
+    if book_path is not None:
+        queryset = queryset.filter(**{book_path: book})
+
+    return queryset.order_by('-pk').values_list('pk', flat=True).first()
+
+
+def endpoints(router, user, book):
+    """
+    ``(name, path, params)`` of the GET routes of a router.
+
+    Detail routes use the newest visible object and list routes filtered by
+    ``book`` ask for that book, the way clients call them. Routes without an
+    object to show are left out.
+    """
+    request = Request(APIRequestFactory().get('/'))
+    request.user = user
+
+    for pattern in router.urls:
+        if 'format' in pattern.pattern.regex.groupindex:
+            continue
+
+        actions = getattr(pattern.callback, 'actions', None)
+
+        if actions is None:
+            yield pattern.name, reverse(pattern.name), {}
+            continue
+
+        if 'get' not in actions:
+            continue
+
+        viewset = pattern.callback.cls
+        view = viewset(
+            request=request, args=(), kwargs={}, action=actions['get'], format_kwarg=None)
+        groups = list(pattern.pattern.regex.groupindex)
+
+        # 需要其他路徑參數的 action 不知道該填什麼
+        if set(groups) - {view.lookup_url_kwarg or view.lookup_field}:
+            continue
+
+        kwargs = {group: sample_pk(view, book) for group in groups}
+        params = {}
+
+        if None in kwargs.values():
+            continue
+        if not kwargs and 'book' in getattr(viewset, 'filterset_fields', ()):
+            params['book'] = book
+
+        yield pattern.name, reverse(pattern.name, kwargs=kwargs), params
+
+
+def measure(client, path, params, repeat, warm):
+    def get():
+        # 預設每次都清掉回應快取，量到的是實際讀取與序列化的成本
+        if not warm:
+            cache.get_backend().clear()
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = client.get(path, params)
+
+            # 串流回應要讀完內容才算做完
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+        return response, len(queries)
+
+    response, queries = get()
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response, queries = get()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # tracemalloc 會拖慢請求，記憶體另外量一次
+    gc.collect()
+    tracemalloc.start()
+    try:
+        get()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'path': path,
+        'params': params,
+        'status': response.status_code,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': queries,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(router, user, book, repeat=50, warm=False, names=None):
+    """
+    Request every GET route of ``router`` as ``user`` and time it.
+
+    Requests go through the whole stack in-process, including JWT
+    authentication, so results are comparable between commits on the same
+    machine and data set.
+    """
+    client = APIClient()
+    token = add_claims(RefreshToken.for_user(user), user.pk).access_token
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    results = {}
+
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for name, path, params in endpoints(router, user, book):
+            if names and name not in names:
+                continue
+
+            results[name] = measure(client, path, params, repeat, warm)
+
+    return {
+        'database': connections['default'].vendor,
+        'user': user.pk,
+        'book': book,
+        'repeat': repeat,
+        'warm_cache': warm,
+        'endpoints': results,
+    }
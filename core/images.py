@@ -0,0 +1,150 @@
+import io
+import logging
+import os
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db.models.signals import post_save, pre_save
+from django_cleanup.signals import cleanup_pre_delete
+from PIL import Image, ImageOps
+
+from app.jobs.queue import enqueue
+
+
+logger = logging.getLogger(__name__)
+
+# 原圖也會去掉 EXIF 並限制長邊，變體依序為 (長邊上限, 格式, 副檔名)
+MAX_SIDE = 2048
+VARIANTS = {
+    'thumbnail': (200, 'JPEG', '.jpg'),
+    'medium': (1024, 'JPEG', '.jpg'),
+    'webp': (1024, 'WEBP', '.webp'),
+}
+FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.gif': 'GIF',
+    '.webp': 'WEBP',
+}
+
+
+def variant_name(name, variant):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{variant}{VARIANTS[variant][2]}'
+
+
+def variant_urls(field_file):
+    """URLs of the variants, which appear once the worker is done."""
+    if not field_file:
+        return None
+
+    return {
+        variant: field_file.storage.url(variant_name(field_file.name, variant))
+        for variant in VARIANTS
+    }
+
+
+def resize(image, max_side, format):
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    # 重新編碼時不帶 exif 參數，EXIF 與 GPS 資訊就不會留下來
+    image.save(output, format, quality=85, optimize=format == 'JPEG')
+
+    return ContentFile(output.getvalue())
+
+
+def process(storage, name):
+    """
+    Re-encode an uploaded image and write its variants next to it.
+
+    The original is rotated by its EXIF orientation, capped to ``MAX_SIDE``
+    and saved again without metadata. Returns the name it was saved under,
+    which differs from ``name`` when the storage names files by content.
+    """
+    try:
+        with storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+    except FileNotFoundError:
+        return None
+    except (OSError, Image.DecompressionBombError):
+        logger.warning('Cannot process image %s', name, exc_info=True)
+        return None
+
+    image = ImageOps.exif_transpose(image)
+    format = FORMATS.get(os.path.splitext(name)[1].lower(), image.format or 'PNG')
+
+    storage.delete(name)
+    name = storage.save(name, resize(image, MAX_SIDE, format))
+
+    for variant, (max_side, variant_format, _) in VARIANTS.items():
+        path = variant_name(name, variant)
+        storage.delete(path)
+
+        # 同時處理同一張圖時，以另一方已寫好的變體為準
+        saved = storage.save(path, resize(image, max_side, variant_format))
+        if saved != path:
+            storage.delete(saved)
+
+    return name
+
+
+def process_field(model, field, name):
+    """Process an uploaded image and point the rows using it to the result."""
+    model = apps.get_model(model)
+    processed = process(model._meta.get_field(field).storage, name)
+
+    if processed is None or processed == name:
+        return
+
+    for instance in model._default_manager.filter(**{field: name}):
+        setattr(instance, field, processed)
+        instance.save(update_fields=[field])
+
+
+def schedule(model, field, name):
+    """Process the image in a background job once the upload is committed."""
+    enqueue(process_field, model._meta.label, field, name)
+
+
+def delete_variants(sender, file, **kwargs):
+    is_referenced = getattr(file.storage, 'is_referenced', None)
+
+    # 內容相同的檔案共用變體，還有人使用時不刪
+    if is_referenced is not None and is_referenced(file.name):
+        return
+
+    for variant in VARIANTS:
+        file.storage.delete(variant_name(file.name, variant))
+
+
+def remember_uploads(sender, instance, raw=False, **kwargs):
+    instance._image_uploads = [
+        name for name in sender._image_fields
+        if getattr(instance, name) and not getattr(instance, name)._committed
+    ]
+
+
+def process_uploads(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    for name in getattr(instance, '_image_uploads', []):
+        schedule(sender, name, getattr(instance, name).name)
+
+
+def register(model, *fields):
+    """Generate the variants of the given image fields on every upload."""
+    model._image_fields = fields
+    pre_save.connect(remember_uploads, sender=model)
+    post_save.connect(process_uploads, sender=model)
+
+
+# 刪除後 file.name 會被清空，要在刪除前取得變體的路徑
+cleanup_pre_delete.connect(delete_variants)
@@ -0,0 +1,60 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def tabulate(data):
+    """
+    Turn lists of objects with the same keys into ``columns`` and ``rows``.
+
+    Keys are then written once per list instead of once per object, which is
+    most of the size of a long list of short objects.
+    """
+    if isinstance(data, dict):
+        return {key: tabulate(value) for key, value in data.items()}
+    if not isinstance(data, list):
+        return data
+
+    items = [tabulate(item) for item in data]
+
+    if not items or not all(isinstance(item, dict) for item in items):
+        return items
+
+    columns = list(items[0])
+
+    if any(list(item) != columns for item in items):
+        return items
+
+    return {
+        'columns': columns,
+        'rows': [list(item.values()) for item in items],
+    }
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """JSON with the lists of objects in ``columns`` and ``rows``."""
+    media_type = 'application/vnd.compact+json'
+    format = 'compact'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(tabulate(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack, when the ``msgpack`` package is installed."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # 其他型別照 JSON 的方式轉成字串或數字
+        return msgpack.packb(data, default=self.encoder.default, use_bin_type=True)
@@ -0,0 +1,130 @@
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+
+DEFAULTS = {
+    'DATABASES': [],
+    'STICKY_SECONDS': 10,
+    'APPS': ['app.accounts', 'app.users'],
+}
+
+_state = threading.local()
+
+
+def get_setting(name):
+    return getattr(settings, 'REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def pin_key(user):
+    return f'replicas:pinned:{user}'
+
+
+def pin(user):
+    """Read from the primary for the user's next ``STICKY_SECONDS``."""
+    cache.set(pin_key(user), True, get_setting('STICKY_SECONDS'))
+
+
+def is_pinned(user):
+    return cache.get(pin_key(user)) is not None
+
+
+def token_user(request):
+    """The user id of the request's access token, or ``None``."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+
+    if not raw_token:
+        return None
+
+    try:
+        return authentication.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+    except (InvalidToken, TokenError):
+        return None
+
+
+class ReplicaRouter:
+    """
+    Send the reads of a request chosen by ``ReplicaMiddleware`` to a replica.
+
+    Everything else, including every write, goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        # 從 replica 讀出的物件存檔時也要寫回主資料庫
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *get_setting('DATABASES')}
+
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # replica 由資料庫複寫同步，不自己建表
+        if db in get_setting('DATABASES'):
+            return False
+
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Read from a replica on safe requests to the views of ``APPS``.
+
+    Users who sent any unsafe request, to any view, within the last
+    ``STICKY_SECONDS`` keep reading from the primary, so they see their own writes while the replicas catch up. One
+    replica serves the whole request, so its queries see the same state.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.alias = None
+
+        user = getattr(request, 'replica_writer', None)
+
+        if user is not None:
+            pin(user)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = get_setting('DATABASES')
+        view = getattr(view_func, 'cls', view_func)
+        apps = tuple(f'{app}.' for app in get_setting('APPS'))
+        safe = request.method in SAFE_METHODS
+
+        # 寫入不論經過哪個 view（例如 batch）都要固定到主資料庫
+        if not replicas or safe and not view.__module__.startswith(apps):
+            return None
+
+        user = token_user(request)
+
+        if user is None:
+            return None
+
+        if not safe:
+            request.replica_writer = user
+        elif not is_pinned(user):
+            _state.alias = random.choice(replicas)
+
+        return None
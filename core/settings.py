@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 import environ
 
 from datetime import timedelta
+from importlib.util import find_spec
 
 
 env = environ.Env()
@@ -58,18 +59,21 @@ THIRD_PARTY_APPS = [
 
 LOCAL_APPS = [
     'app.accounts',
+    'app.jobs',
     'app.users',
 ]
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
+    'core.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -104,6 +108,23 @@ DATABASES = {
     'default': env.db_url(),
 }
 
+# 唯讀的 replica，以逗號分隔多個網址；測試時沿用主資料庫
+REPLICA_DATABASE_URLS = env.list('REPLICA_DATABASE_URLS', default=[])
+
+for index, url in enumerate(REPLICA_DATABASE_URLS):
+    DATABASES[f'replica_{index}'] = {
+        **env.db_url_config(url),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+
+# 寫入後 STICKY_SECONDS 秒內，同一個使用者的讀取仍走主資料庫
+REPLICAS = {
+    'DATABASES': [f'replica_{index}' for index in range(len(REPLICA_DATABASE_URLS))],
+    'STICKY_SECONDS': env.int('REPLICA_STICKY_SECONDS', default=10),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -154,14 +175,34 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = root('media')
 
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+
+# 分段上傳中的檔案，完成後才移到 MEDIA_ROOT
+UPLOAD_SESSION_DIR = env('UPLOAD_SESSION_DIR', default=root('uploads'))
+
+UPLOAD_SESSION_MAX_SIZE = env.int('UPLOAD_SESSION_MAX_SIZE', default=50 * 1024 * 1024)
+
+# 寫入中的請求超過這麼多秒沒完成，其他請求就可以接手
+UPLOAD_SESSION_LEASE = env.int('UPLOAD_SESSION_LEASE', default=10 * 60)
+
+# 超過這麼多秒沒有更新的上傳連同檔案一起刪除
+UPLOAD_SESSION_EXPIRY = env.int('UPLOAD_SESSION_EXPIRY', default=24 * 60 * 60)
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.accounts.tokens.BookJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # 依 Accept 選擇格式，預設仍是 JSON；MessagePack 要另外安裝 msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'core.renderers.CompactJSONRenderer',
+        *(['core.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    ],
 }
 
 
@@ -171,5 +212,37 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
 }
 
+# 每個請求的耗時分析，超過門檻時記錄 log，METRICS 開啟時由 /metrics 提供直方圖
+# HEADER 會讓任何人看到各端點的查詢數與耗時，只在開發時打開
+SERVER_TIMING = {
+    'HEADER': env.bool('SERVER_TIMING_HEADER', default=False),
+    'SLOW_REQUEST_MS': env.float('SLOW_REQUEST_MS', default=500),
+    'SLOW_QUERY_MS': env.float('SLOW_QUERY_MS', default=100),
+    'MAX_QUERIES': env.int('SLOW_REQUEST_QUERIES', default=50),
+    'MAX_DUPLICATES': env.int('SLOW_REQUEST_DUPLICATES', default=10),
+    'METRICS': env.bool('SERVER_TIMING_METRICS', default=False),
+}
+
+# 撤銷憑證後，其他 worker 最晚在這段時間後拒絕舊憑證
+TOKEN_EPOCH_CACHE_TIMEOUT = env.int('TOKEN_EPOCH_CACHE_TIMEOUT', default=60)
+
+# 帳本讀取的回應快取，BACKEND 為 lru 或 CACHES 的別名
+ACCOUNTS_RESPONSE_CACHE = {
+    'BACKEND': env('ACCOUNTS_RESPONSE_CACHE', default='lru'),
+    'MAX_SIZE': env.int('ACCOUNTS_RESPONSE_CACHE_SIZE', default=64 * 1024 * 1024),
+    'TIMEOUT': 300,
+}
+
+# 帳本即時事件的轉送方式，多個 worker 時換成跨程序的 Broker
+ACCOUNTS_EVENT_BROKER = env('ACCOUNTS_EVENT_BROKER', default='app.accounts.events.LocalBroker')
+
+# 背景工作由 manage.py run_worker 執行，逾時未完成的工作會重新交給其他 worker
+JOBS = {
+    'VISIBILITY_TIMEOUT': env.int('JOBS_VISIBILITY_TIMEOUT', default=300),
+    'MAX_ATTEMPTS': env.int('JOBS_MAX_ATTEMPTS', default=5),
+    'BACKOFF': env.float('JOBS_BACKOFF', default=10),
+    'MAX_BACKOFF': env.float('JOBS_MAX_BACKOFF', default=3600),
+}
+
 EMAIL_URL = env.email_url()
 vars().update(EMAIL_URL)
@@ -0,0 +1,91 @@
+from django.core.exceptions import FieldDoesNotExist
+
+from rest_framework import fields, serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def serializer_fields(serializer):
+    """The fields of ``serializer``, or of its child for ``many=True``."""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    return serializer.fields
+
+
+def columns(serializer, model):
+    """
+    Model columns ``serializer`` reads, or ``None`` when they are unknown.
+
+    Method fields and sources that are not model fields may read anything
+    from the instance, deferring columns for them would cost a query each.
+    """
+    names = [model._meta.pk.name]
+
+    for field in serializer_fields(serializer).values():
+        if field.write_only:
+            continue
+        if isinstance(field, fields.SerializerMethodField) or \
+                '.' in field.source or field.source == '*':
+            return None
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+
+        names.append(model_field.name)
+
+    return names
+
+
+class SparseFieldsMixin:
+    """
+    Let ``?fields=id,name`` pick the fields of read responses.
+
+    Other fields are dropped from the serializer, and list and detail
+    queries only load the columns the remaining fields read.
+    """
+    fields_param = 'fields'
+
+    def get_requested_fields(self):
+        value = self.request.query_params.get(self.fields_param)
+
+        if value is None or self.request.method not in SAFE_METHODS:
+            return None
+
+        return [name for name in value.split(',') if name]
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        requested = self.get_requested_fields()
+
+        if requested is None:
+            return serializer
+
+        readable = serializer_fields(serializer)
+        unknown = set(requested) - {
+            name for name, field in readable.items() if not field.write_only}
+
+        if unknown:
+            raise ValidationError({self.fields_param: [
+                f'Unknown fields: {", ".join(sorted(unknown))}.']})
+
+        for name in list(readable):
+            if name not in requested:
+                readable.pop(name)
+
+        return serializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        if self.action not in ('list', 'retrieve') or self.get_requested_fields() is None:
+            return queryset
+
+        names = columns(self.get_serializer(), queryset.model)
+
+        return queryset if names is None else queryset.only(*names)
@@ -0,0 +1,102 @@
+import functools
+import hashlib
+import os
+import posixpath
+import re
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.views import static
+
+
+# 以內容雜湊命名的檔案與其變體，內容不會再改變
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{64}(\.\w+)?\.\w+$')
+VARIANT_NAME = re.compile(r'(^|/)[0-9a-f]{64}\.\w+\.\w+$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store files under the SHA-256 of their content.
+
+    The directory chosen by ``upload_to`` is kept and the file name is
+    replaced by the digest, so identical uploads share one file and a name
+    never points to different content. Derived files such as image variants
+    keep the name given to them. Files are only deleted once no file field
+    refers to them anymore.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+
+        if VARIANT_NAME.search(name):
+            return super().save(name, content, max_length)
+
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        name = name.replace('\\', '/')
+        directory = posixpath.dirname(name)
+
+        # 重新存入已雜湊命名的檔案時，去掉原本的分層目錄
+        if HASHED_NAME.search(name):
+            directory = posixpath.dirname(directory)
+
+        digest = digest.hexdigest()
+        name = posixpath.join(
+            directory,
+            digest[:2],
+            digest + os.path.splitext(name)[1].lower(),
+        )
+
+        if self.exists(name):
+            return name
+
+        return super().save(name, content, max_length)
+
+    def is_referenced(self, name):
+        """
+        Whether a row's file field in this storage still uses ``name``.
+
+        The file fields are indexed, so each lookup is a single index probe
+        and the first match ends the search.
+        """
+        return any(
+            model._default_manager.filter(**{field.name: name}).exists()
+            for model, field in file_fields()
+        )
+
+    def delete(self, name):
+        # 變體不會存在檔案欄位裡，不必查
+        if VARIANT_NAME.search(name) or not self.is_referenced(name):
+            super().delete(name)
+
+
+@functools.lru_cache(maxsize=None)
+def file_fields():
+    """``(model, field)`` of the file fields stored in ``ContentAddressedStorage``."""
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        # 新增的檔案欄位要加上 db_index，否則每次刪除都會掃過整張表
+        if isinstance(field, models.FileField) and
+        isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """``django.views.static.serve`` with far-future caching for hashed names."""
+    response = static.serve(request, path, document_root, show_indexes)
+
+    if HASHED_NAME.search(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+
+    return response
@@ -0,0 +1,278 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import BasePermission
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HEADER': False,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_QUERY_MS': 100,
+    'MAX_QUERIES': 50,
+    'MAX_DUPLICATES': 10,
+    'METRICS': False,
+}
+# 直方圖的上界（毫秒）
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def get_setting(name):
+    return getattr(settings, 'SERVER_TIMING', {}).get(name, DEFAULTS[name])
+
+
+class Timer:
+    """
+    Time spent in the parts of one request.
+
+    Spans exclude the database time spent inside them, which is reported
+    once as ``db``, so the parts add up to no more than the total.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = defaultdict(float)
+        self.queries = []
+        self.db = 0.0
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.db += duration
+            self.queries.append((sql, duration))
+
+    def begin(self, name):
+        """Start a span and return the function that ends it."""
+        start, db = time.perf_counter(), self.db
+
+        def end(*args):
+            self.spans[name] += (time.perf_counter() - start) * 1000 - (self.db - db)
+
+        return end
+
+    @contextmanager
+    def span(self, name):
+        end = self.begin(name)
+
+        try:
+            yield
+        finally:
+            end()
+
+    @property
+    def total(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def duplicates(self):
+        """Statements run more than once, such as the queries of an N+1 loop."""
+        return {
+            sql: count for sql, count in Counter(sql for sql, _ in self.queries).items()
+            if count > 1
+        }
+
+    def header(self, total):
+        duplicates = sum(count - 1 for count in self.duplicates().values())
+        metrics = [
+            f'db;dur={self.db:.1f};desc="{len(self.queries)} queries ({duplicates} duplicates)"',
+            *(f'{name};dur={duration:.1f}' for name, duration in self.spans.items()),
+            f'total;dur={total:.1f}',
+        ]
+
+        return ', '.join(metrics)
+
+
+@contextmanager
+def span(request, name):
+    """Time a part of the request, if the timing middleware is installed."""
+    timer = getattr(request, 'timer', None)
+
+    if timer is None:
+        yield
+    else:
+        with timer.span(name):
+            yield
+
+
+class Histogram:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels, value):
+        with self.lock:
+            buckets, total, count = self.series.get(labels, ([0] * len(BUCKETS), 0.0, 0))
+            buckets = [
+                bucket + (value <= bound) for bucket, bound in zip(buckets, BUCKETS)
+            ]
+            self.series[labels] = (buckets, total + value, count + 1)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def export(self, name):
+        """The series in the Prometheus text format, in seconds."""
+        lines = [f'# TYPE {name} histogram']
+
+        with self.lock:
+            series = sorted(self.series.items())
+
+        for (method, route), (buckets, total, count) in series:
+            labels = f'method="{method}",route="{route}"'
+
+            for bound, bucket in zip(BUCKETS, buckets):
+                lines.append(f'{name}_bucket{{{labels},le="{bound / 1000}"}} {bucket}')
+
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{labels}}} {total / 1000}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+
+        return lines
+
+
+durations = Histogram()
+db_durations = Histogram()
+
+
+class ServerTimingMiddleware:
+    """
+    Measure every request and report where the time went.
+
+    The breakdown is logged when a request is slow or runs too many or
+    repeated queries. With ``HEADER`` on, it is also sent in a
+    ``Server-Timing`` header, which browser developer tools display, and
+    with ``METRICS`` on, durations are kept in histograms per route for the
+    ``metrics`` view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = request.timer = Timer()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer.execute))
+
+            response = self.get_response(request)
+
+        total = timer.total
+
+        if get_setting('HEADER'):
+            response['Server-Timing'] = timer.header(total)
+
+        self.report(request, response, timer, total)
+
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF 的 Response 在中介層之後才轉成 JSON
+        timer = getattr(request, 'timer', None)
+
+        if timer is not None:
+            response.add_post_render_callback(timer.begin('render'))
+
+        return response
+
+    def report(self, request, response, timer, total):
+        match = request.resolver_match
+        route = match.view_name if match else '<unresolved>'
+
+        if get_setting('METRICS'):
+            durations.observe((request.method, route), total)
+            db_durations.observe((request.method, route), timer.db)
+
+        for sql, duration in timer.queries:
+            if duration > get_setting('SLOW_QUERY_MS'):
+                logger.warning(
+                    'Slow query route=%s duration_ms=%.1f sql=%s', route, duration, sql,
+                    extra={'route': route, 'duration_ms': duration, 'sql': sql})
+
+        duplicates = timer.duplicates()
+        repeated = sum(count - 1 for count in duplicates.values())
+
+        if total > get_setting('SLOW_REQUEST_MS') or \
+                len(timer.queries) > get_setting('MAX_QUERIES') or \
+                repeated > get_setting('MAX_DUPLICATES'):
+            record = {
+                'method': request.method,
+                'path': request.path,
+                'route': route,
+                'status': response.status_code,
+                'total_ms': round(total, 1),
+                'db_ms': round(timer.db, 1),
+                'queries': len(timer.queries),
+                'duplicates': repeated,
+                **{f'{name}_ms': round(duration, 1) for name, duration in timer.spans.items()},
+            }
+            most_repeated = max(duplicates, key=duplicates.get) if duplicates else None
+
+            logger.warning(
+                'Slow request %s most_repeated=%s',
+                ' '.join(f'{key}={value}' for key, value in record.items()),
+                most_repeated,
+                extra={**record, 'most_repeated': most_repeated})
+
+
+class TimingMixin:
+    """Time authentication, permission checks and serialization of a view."""
+
+    def perform_authentication(self, request):
+        with span(request, 'auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with span(request, 'permissions'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with span(request, 'permissions'):
+            super().check_object_permissions(request, obj)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        to_representation = serializer.to_representation
+
+        def timed(instance):
+            with span(self.request, 'serialize'):
+                return to_representation(instance)
+
+        # 只包住最外層的 serializer，巢狀的欄位算在同一段裡
+        serializer.to_representation = timed
+
+        return serializer
+
+
+class IsStaff(BasePermission):
+    def has_permission(self, request, view):
+        # 以 JWT 驗證時 request.user 不是資料庫裡的使用者
+        return getattr(request.user, 'instance', request.user).is_staff
+
+
+@api_view(['GET'])
+@permission_classes([IsStaff])
+def metrics(request):
+    """Request duration histograms per route, for Prometheus to scrape."""
+    if not get_setting('METRICS'):
+        raise Http404
+
+    lines = [
+        *durations.export('http_request_duration_seconds'),
+        *db_durations.export('http_request_db_duration_seconds'),
+    ]
+
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
@@ -19,10 +19,18 @@ from app.accounts.views import(
     CategoryViewSet,
     ConsumeViewSet,
     ProportionViewSet,
+    UploadSessionViewSet,
+)
+from app.accounts.tokens import (
+    BookTokenObtainPairSerializer,
+    BookTokenRefreshSerializer,
 )
 from app.users.views import UserViewSet
 
 from core.settings import MEDIA_ROOT, MEDIA_URL
+from core.batch import BatchView
+from core.storage import serve
+from core.timing import metrics
 
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -43,13 +51,24 @@ router.register('authorities', AuthorityViewSet)
 router.register('consume', ConsumeViewSet)
 router.register('proportion', ProportionViewSet)
 router.register('categories', CategoryViewSet)
+router.register('uploads', UploadSessionViewSet)
 router.register('users', UserViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('token', TokenObtainPairView.as_view(), name='token-create'),
-    path('token/refresh', TokenRefreshView.as_view(), name='token-refresh'),
+    path('batch', BatchView.as_view(viewsets=[
+        AccountBookViewSet,
+        AuthorityViewSet,
+        CategoryViewSet,
+        ConsumeViewSet,
+        ProportionViewSet,
+    ]), name='batch'),
+    path('token', TokenObtainPairView.as_view(
+        serializer_class=BookTokenObtainPairSerializer), name='token-create'),
+    path('token/refresh', TokenRefreshView.as_view(
+        serializer_class=BookTokenRefreshSerializer), name='token-refresh'),
+    path('metrics', metrics, name='metrics'),
 
     path('admin/', admin.site.urls),
-    *static(MEDIA_URL, document_root=MEDIA_ROOT),
+    *static(MEDIA_URL, serve, document_root=MEDIA_ROOT),
 ]